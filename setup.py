@@ -59,6 +59,7 @@ REQUIRED = [
 # What packages are optional?
 EXTRAS = {
     # 'fancy feature': ['django'],
+    "fast-json": ["orjson"],
 }
 
 # The rest you shouldn't have to touch too much :)
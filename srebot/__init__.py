@@ -6,6 +6,22 @@ global_data = {
     'config': None
 }
 
+
+def on(topic, qos=0):
+    """
+    Registers a function of a bot as handler for messages matching the
+    topic filter; called like on_message(client, msg, payload).
+
+        @on("trigger/+/restart")
+        def restart(client, msg, payload):
+            ...
+    """
+    def decorator(func):
+        func.sre_topics = getattr(func, 'sre_topics', []) + [(topic, qos)]
+        return func
+    return decorator
+
+
 @click.group()
 @click.option("-l", "--log-level", type=click.Choice(['debug', 'info', 'warn', 'error'], case_sensitive=False))
 @click.option("-c", "--config-file")
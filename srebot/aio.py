@@ -0,0 +1,207 @@
+import asyncio
+import inspect
+import threading
+import traceback
+from . import global_data
+
+_loop = None
+_thread = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    """
+    The event loop shared by all async bots of the process; runs in its own
+    thread.
+    """
+    global _loop, _thread
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name="asyncio")
+            _thread.daemon = True
+            _thread.start()
+    return _loop
+
+
+def _call_in_loop(loop, func, *args):
+    if threading.current_thread() is _thread:
+        func(*args)
+    else:
+        loop.call_soon_threadsafe(func, *args)
+
+
+def is_async_bot(module):
+    from .mqtt_tools import _get_handlers
+
+    functions = [getattr(module, "run", None), getattr(module, "on_message", None)]
+    return any(inspect.iscoroutinefunction(x) for x in functions + _get_handlers(module))
+
+
+def run(coroutine, timeout=None):
+    """
+    Runs coroutine on the shared loop and waits for its result; must not be
+    called from the loop itself.
+    """
+    from .worker import RunTimeout
+
+    async def wrapper():
+        try:
+            return await asyncio.wait_for(coroutine, timeout)
+        except asyncio.TimeoutError:
+            raise RunTimeout(f"timed out after {timeout}s") from None
+
+    return asyncio.run_coroutine_threadsafe(wrapper(), get_loop()).result()
+
+
+def submit(coroutine, name):
+    """
+    Starts coroutine on the shared loop without waiting; exceptions are
+    logged.
+    """
+
+    def done(future):
+        if not future.cancelled() and future.exception():
+            ex = future.exception()
+            global_data["config"].logger.error(
+                f"{name}: {ex}\n\n"
+                + "".join(traceback.format_exception(type(ex), ex, ex.__traceback__))
+            )
+
+    future = asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+    future.add_done_callback(done)
+    return future
+
+
+def call_run(module, client, timeout=None):
+    """
+    Calls run() of the bot; coroutines are run on the shared loop with an
+    AsyncClient.
+    """
+    if inspect.iscoroutinefunction(module.run):
+        return run(module.run(AsyncClient(client)), timeout)
+    return module.run(client)
+
+
+class AsyncClient(object):
+    """
+    mqttwrapper for async bots: publish is awaitable and returns when the
+    broker acknowledged a qos 1/2 message.
+    """
+
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+
+    def __getattr__(self, name):
+        return getattr(self.wrapper, name)
+
+    async def _wait(self, infos, timeout):
+        from .mqtt_tools import get_tracker
+
+        if not infos:
+            return
+        tracker = get_tracker(self.wrapper.client)
+        loop = asyncio.get_running_loop()
+        futures = []
+        for info in infos:
+            future = loop.create_future()
+            tracker.track(
+                info.mid,
+                lambda future=future: loop.call_soon_threadsafe(
+                    lambda: future.done() or future.set_result(None)
+                ),
+            )
+            futures.append(future)
+        if futures:
+            await asyncio.wait_for(asyncio.gather(*futures), timeout)
+
+    async def publish(self, path, payload=None, qos=0, retain=False, timeout=10):
+        info = self.wrapper.publish(path, payload=payload, qos=qos, retain=retain)
+        if info is not None and qos:
+            await self._wait([info], timeout)
+        return info
+
+    async def publish_many(self, items, qos=0, retain=False, timeout=10):
+        items = list(items)
+        infos = self.wrapper.publish_many(items, qos=qos, retain=retain)
+        await self._wait(
+            [
+                info
+                for item, info in zip(items, infos)
+                if info is not None and (item[2] if len(item) > 2 else qos)
+            ],
+            timeout,
+        )
+        return infos
+
+
+class LoopDriver(object):
+    """
+    Drives a paho client from the shared event loop: its socket is watched
+    with add_reader/add_writer instead of paho's network thread; connection
+    losses are retried with backoff.
+    """
+
+    def __init__(self, client, loop, max_delay=60):
+        self.client = client
+        self.loop = loop
+        self.delay = 1
+        self.max_delay = max_delay
+        self.connecting = False
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def start(self):
+        self.connecting = True
+        self.loop.call_soon_threadsafe(self._connect)
+        self.loop.call_soon_threadsafe(self._misc)
+
+    def _connect(self):
+        # connecting blocks up to the keepalive against an unreachable broker;
+        # the socket is registered on the loop by on_socket_open
+        self.loop.run_in_executor(None, self.client.reconnect).add_done_callback(
+            self._connected
+        )
+
+    def _connected(self, future):
+        ex = future.exception()
+        if ex:
+            global_data["config"].logger.error(
+                f"Connecting to broker failed: {ex} - retrying in {self.delay}s"
+            )
+            self.loop.call_later(self.delay, self._connect)
+            self.delay = min(self.delay * 2, self.max_delay)
+            return
+        self.delay = 1
+        self.connecting = False
+
+    def _misc(self):
+        self.client.loop_misc()
+        self.loop.call_later(1, self._misc)
+
+    def on_socket_open(self, client, userdata, sock):
+        _call_in_loop(self.loop, self.loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        _call_in_loop(self.loop, self.loop.remove_reader, sock)
+        _call_in_loop(self.loop, self.loop.remove_writer, sock)
+        if not self.connecting:
+            self.connecting = True
+            _call_in_loop(self.loop, self.loop.call_later, self.delay, self._connect)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        _call_in_loop(self.loop, self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        _call_in_loop(self.loop, self.loop.remove_writer, sock)
+
+
+def drive(client):
+    """
+    Connects client (connect_async must have been called) from the shared
+    loop and blocks forever.
+    """
+    LoopDriver(client, get_loop()).start()
+    _thread.join()
@@ -0,0 +1,406 @@
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+import click
+import paho.mqtt.client as mqtt
+
+BENCH_BOT = """
+import time
+LATENCIES = []
+SUBSCRIPTIONS = ["bench/#"]
+
+def on_message(client, msg, payload=None):
+    LATENCIES.append(time.perf_counter() - float(msg.payload))
+"""
+
+
+class FakeBroker(object):
+    """
+    Stand-in for an mqtt broker: delivers published messages synchronously
+    to all fake clients with a matching subscription. Shared subscriptions
+    ($share/<group>/<filter>) get each message round robin per group.
+    """
+
+    def __init__(self):
+        self.subscriptions = []
+        self.shared = {}
+        self.lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, client, topic, qos=0):
+        with self.lock:
+            if topic.startswith("$share/"):
+                _, group, sub = topic.split("/", 2)
+                members = self.shared.setdefault((group, sub), [0, []])[1]
+                if client not in members:
+                    members.append(client)
+            else:
+                self.subscriptions.append((topic, client))
+
+    def unsubscribe(self, client, topic):
+        with self.lock:
+            if topic.startswith("$share/"):
+                _, group, sub = topic.split("/", 2)
+                members = self.shared.get((group, sub), [0, []])[1]
+                if client in members:
+                    members.remove(client)
+                return
+            self.subscriptions = [
+                x for x in self.subscriptions if x != (topic, client)
+            ]
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        with self.lock:
+            self.published += 1
+            receivers = [
+                client
+                for sub, client in self.subscriptions
+                if mqtt.topic_matches_sub(sub, topic)
+            ]
+            for (group, sub), shared in self.shared.items():
+                if shared[1] and mqtt.topic_matches_sub(sub, topic):
+                    receivers.append(shared[1][shared[0] % len(shared[1])])
+                    shared[0] += 1
+        for client in receivers:
+            client.deliver(topic, payload, qos, retain)
+
+
+class FakeInfo(object):
+    def __init__(self, mid):
+        self.mid = mid
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+
+
+class FakeClient(object):
+    """
+    Implements the part of paho's Client used by srebot on top of FakeBroker.
+    Without broker, published messages are only counted.
+    """
+
+    def __init__(self, broker=None):
+        self.broker = broker
+        self.mid = 0
+        self.published = 0
+        self.on_connect = None
+        self.on_message = None
+        self.on_publish = None
+
+    def connect(self, *args, **kwargs):
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0, None)
+
+    def is_connected(self):
+        return True
+
+    def subscribe(self, topic, qos=0):
+        topics = [(topic, qos)] if isinstance(topic, str) else topic
+        for topic, qos in topics:
+            self.broker.subscribe(self, topic, qos)
+
+    def unsubscribe(self, topic):
+        for topic in [topic] if isinstance(topic, str) else topic:
+            self.broker.unsubscribe(self, topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.mid += 1
+        self.published += 1
+        if self.broker:
+            self.broker.publish(topic, payload, qos, retain)
+        if self.on_publish:
+            self.on_publish(self, None, self.mid)
+        return FakeInfo(self.mid)
+
+    def deliver(self, topic, payload, qos=0, retain=False):
+        msg = mqtt.MQTTMessage(topic=topic.encode())
+        msg.payload = payload if isinstance(payload, bytes) else str(payload).encode()
+        msg.qos = qos
+        msg.retain = retain
+        if self.on_message:
+            self.on_message(self, None, msg)
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _result(name, count, duration, latencies):
+    return {
+        "name": name,
+        "count": count,
+        "throughput": count / duration if duration else 0,
+        "p50": _percentile(latencies, 50),
+        "p99": _percentile(latencies, 99),
+        "rss": _peak_rss_mb(),
+    }
+
+
+def bench_on_message(config, count, workdir, **kwargs):
+    from .mqtt_tools import on_connect, on_message
+    from .dispatcher import get_dispatcher
+    from .tools import get_module
+
+    script = workdir / "bench_bot.py"
+    script.write_text(BENCH_BOT)
+    config.bot = script
+    broker = FakeBroker()
+    client = FakeClient(broker)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect()
+    publisher = FakeClient(broker)
+
+    started = time.perf_counter()
+    for i in range(count):
+        publisher.publish(f"bench/{i % 10}", str(time.perf_counter()))
+    for q in get_dispatcher().queues:
+        q.join()
+    duration = time.perf_counter() - started
+    config.bot = False
+    return _result("on_message", count, duration, get_module(script).LATENCIES)
+
+
+SHARED_BOT = """
+import threading
+WORKER_GROUP = "bench"
+SUBSCRIPTIONS = ["shared/#"]
+HANDLED = []
+LOCK = threading.Lock()
+
+def on_message(client, msg, payload=None):
+    with LOCK:
+        HANDLED.append((id(client.client), msg.topic))
+"""
+
+
+def bench_shared(config, count, workdir, instances=3, **kwargs):
+    """
+    Several instances of a bot with WORKER_GROUP on one stand-in broker;
+    fails unless every message was handled exactly once.
+    """
+    from .mqtt_tools import on_connect, on_message
+    from .dispatcher import get_dispatcher
+    from .tools import get_module, _raise_error
+
+    script = workdir / "shared_bot.py"
+    script.write_text(SHARED_BOT)
+    config.bot = script
+    broker = FakeBroker()
+    clients = []
+    for i in range(instances):
+        client = FakeClient(broker)
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.connect()
+        clients.append(client)
+    publisher = FakeClient(broker)
+
+    started = time.perf_counter()
+    for i in range(count):
+        publisher.publish(f"shared/{i}", str(i))
+    for q in get_dispatcher().queues:
+        q.join()
+    duration = time.perf_counter() - started
+    config.bot = False
+
+    handled = get_module(script).HANDLED
+    topics = [topic for _, topic in handled]
+    per_instance = [sum(1 for x, _ in handled if x == id(client)) for client in clients]
+    if len(topics) != count or len(set(topics)) != count:
+        _raise_error(
+            f"Shared subscription: {count} messages published, {len(topics)} handled, "
+            f"{len(set(topics))} distinct"
+        )
+    click.secho(f"messages per instance: {per_instance}", fg="green")
+    return _result(f"shared subscription ({instances} instances)", count, duration, [])
+
+
+def bench_publish(config, count, **kwargs):
+    from .mqtt_tools import mqttwrapper
+
+    client = mqttwrapper(FakeClient(), "bench", "bench")
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        client.publish("bench/value", payload={"value": i})
+        latencies.append(time.perf_counter() - t)
+    duration = time.perf_counter() - started
+
+    items = [("bench/value", i) for i in range(count)]
+    t = time.perf_counter()
+    client.publish_many(items)
+    many = time.perf_counter() - t
+    return [
+        _result("publish", count, duration, latencies),
+        _result("publish_many", count, many, [many / count] if count else []),
+    ]
+
+
+def bench_scheduler(config, jobs=20, duration=3, **kwargs):
+    from .scheduler import Scheduler
+
+    scheduler = Scheduler()
+    added = [scheduler.add(f"bench-{i}", "* * * * * */1", lambda: None) for i in range(jobs)]
+    lags = []
+
+    def collect():
+        end = time.time() + duration
+        seen = {}
+        while time.time() < end:
+            for job in added:
+                if job.runs != seen.get(job):
+                    seen[job] = job.runs
+                    lags.append(job.lag)
+            time.sleep(0.01)
+
+    collect()
+    for job in added:
+        scheduler.cancel(job)
+    runs = sum(job.runs for job in added)
+    return _result("scheduler lag", runs, duration, lags)
+
+
+def bench_daemon(config, scripts=200, ticks=20, workdir=None, **kwargs):
+    from .tools import ScriptIndex, _get_md5
+    from .watcher import PollingWatcher
+
+    root = workdir / "bots"
+    for i in range(scripts):
+        path = root / f"group{i % 10}" / f"bot{i}.py"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(BENCH_BOT)
+    for i in range(scripts):
+        # noise that must be pruned
+        path = root / ".git" / "objects" / f"{i}.py"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+
+    t = time.perf_counter()
+    index = ScriptIndex([root])
+    build = time.perf_counter() - t
+    watcher = PollingWatcher([root], interval=0)
+
+    latencies = []
+    files = index.scripts()
+    started = time.perf_counter()
+    for tick in range(ticks):
+        files[tick % len(files)].write_text(BENCH_BOT + f"\n# {tick}\n")
+        t = time.perf_counter()
+        changed = watcher.changed(watcher._scan())
+        index.update(changed)
+        for path in changed:
+            _get_md5(path)
+        latencies.append(time.perf_counter() - t)
+    duration = time.perf_counter() - started
+    return [
+        _result(f"script index build ({scripts} scripts)", 1, build, [build]),
+        _result("daemon tick (polling)", ticks, duration, latencies),
+    ]
+
+
+# 'sre --help' and 'sre list' must not load these
+STARTUP_FORBIDDEN = ("paho", "inquirer", "arrow", "croniter", "simplejson", "srebot.webserver")
+# seconds for importing srebot incl. click (median, python -X importtime)
+STARTUP_BUDGET = 0.15
+SRE = "import sys; sys.argv[:] = {!r}; from srebot import cli; cli()"
+
+
+def _importtime(code):
+    """
+    Returns {module: cumulative seconds} from python -X importtime.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    result = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            result[name.strip()] = int(cumulative) / 1e6
+    return result
+
+
+def bench_startup(config, runs=5, **kwargs):
+    """
+    Startup regression check: fails if a heavy dependency is imported by
+    'sre --help'/'sre list' or importing srebot exceeds STARTUP_BUDGET.
+    """
+    from .tools import _raise_error
+
+    imports, commands = [], {}
+    for i in range(runs):
+        for args in (["--help"], ["list"]):
+            t = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-c", SRE.format(["sre"] + args)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            commands.setdefault(" ".join(args), []).append(time.perf_counter() - t)
+        imports.append(_importtime("from srebot import cli").get("srebot", 0))
+
+    modules = _importtime(SRE.format(["sre", "list"]))
+    forbidden = sorted(
+        x for x in modules if x.split(".")[0] in STARTUP_FORBIDDEN or x in STARTUP_FORBIDDEN
+    )
+    results = [_result("import srebot", runs, sum(imports), imports)]
+    for name, latencies in commands.items():
+        results.append(_result(f"sre {name}", runs, sum(latencies), latencies))
+    if forbidden:
+        _raise_error(f"Imported at startup: {', '.join(forbidden)}")
+    if _percentile(imports, 50) > STARTUP_BUDGET:
+        _raise_error(
+            f"Importing srebot took {_percentile(imports, 50) * 1000:.1f}ms "
+            f"- budget is {STARTUP_BUDGET * 1000:.0f}ms"
+        )
+    return results
+
+
+BENCHMARKS = {
+    "on_message": bench_on_message,
+    "publish": bench_publish,
+    "scheduler": bench_scheduler,
+    "daemon": bench_daemon,
+    "startup": bench_startup,
+    "shared": bench_shared,
+}
+
+
+def run_benchmarks(config, names, count, scripts):
+    names = names or list(BENCHMARKS)
+    workdir = Path(tempfile.mkdtemp(prefix="sre-bench-"))
+    try:
+        for name in names:
+            results = BENCHMARKS[name](
+                config, count=count, scripts=scripts, workdir=workdir
+            )
+            if isinstance(results, dict):
+                results = [results]
+            for result in results:
+                click.secho(
+                    f"{result['name']:<40} {result['count']:>8} ops "
+                    f"{result['throughput']:>12.1f} ops/s "
+                    f"p50 {result['p50'] * 1000:>8.3f}ms "
+                    f"p99 {result['p99'] * 1000:>8.3f}ms "
+                    f"peak rss {result['rss']:.1f}MB",
+                    fg="green",
+                )
+    finally:
+        shutil.rmtree(workdir)
@@ -1,30 +1,26 @@
 #!/usr/bin/env python3
 import traceback
-import arrow
+import inspect
 import stat
 import uuid
 import signal
 import time
 import argparse
-import inquirer
 import sys
 from pathlib import Path
 import os
-import croniter
-import subprocess
-import json
-from datetime import datetime
 import threading
 import click
 from . import cli
 from .config import pass_config
-from .mqtt_tools import PseudoClient
-from .tools import _get_md5, _raise_error, PROC, iterate_scripts, _get_robot_file, kill_proc, _select_bot_path, load_module
+from .tools import _get_md5, _raise_error, iterate_scripts, _get_robot_file, _select_bot_path, load_module, get_module
 from . import global_data
-from . mqtt_tools import _get_mqtt_wrapper, _connect_client, _get_regular_client, on_connect, on_message
-from .webserver import start_webserver
+from . import metrics
 from .tools import _onetime_client
 
+# paho, croniter, inquirer and the webserver are imported in the commands
+# that need them; 'sre list' and 'sre --help' must start fast.
+
 
 VERSION = '0.2'
 
@@ -69,68 +65,117 @@ def list_bots(config):
     for script in iterate_scripts(config):
         click.secho(script, fg='green')
 
-def start_proc(config, path):
-    config.logger.info(f"Starting {path}...")
-    path = path.absolute()
-    os.system(f"pkill -9 -f '{sys.executable} .*{path}'")
-
-    process = subprocess.Popen([
-        sys.executable,
-        sys.argv[0],
-        '-c', config.config_file,
-        '-l', config.config.get('log_level'),
-        'run',
-        path,
-    ])
-    md5 = _get_md5(path)
-    config = global_data['config']
-    config.processes.append(PROC(process=process, path=path, md5=md5))
-
-def run_iter(config, client, scheduler, module, once):
-    from . import global_data
-    global_data['config'] = config
-    base = datetime.now()
-    iter = croniter.croniter(scheduler, base)
-    while True:
+def execute_run(config, client, script):
+    from .mqtt_tools import _get_mqtt_wrapper
+    module = get_module(script)
+    client2 = _get_mqtt_wrapper(client, module)
+    if getattr(module, 'run', None):
+        started = time.perf_counter()
         try:
-            next = iter.get_next(datetime)
-            config.logger.debug(f"Executing {module} next at {next.strftime('%Y-%m-%d %H:%M:%S')}")
-
-            while True:
-                if datetime.now() > next or once:
-
-                    client2 = _get_mqtt_wrapper(client, module)
-                    script_file = config.bot
-                    if getattr(module, 'run', None):
-                        try:
-                            config.logger.debug(f"Running {script_file}:run")
-                            module.run(client2)
-                            client2.publish(script_file.name + '/rc', payload=0)
-                        except Exception as ex:
-                            client2.publish(script_file.name + '/rc', payload=1)
-                            client2.publish(script_file.name + '/last_error', payload=str(ex))
-                            client2.publish('/last_error', payload=f"{script_file}\n{ex}")
-                            config.logger.error(ex)
-                            time.sleep(1)
-                    break
-                time.sleep(0.5)
-
+            config.logger.debug("Running %s:run", script)
+            from .aio import call_run
+            from .worker import run_in_worker, RunTimeout
+            timeout = getattr(module, 'RUN_TIMEOUT', None)
+            try:
+                if timeout and not inspect.iscoroutinefunction(module.run):
+                    run_in_worker(module, client2, float(timeout))
+                else:
+                    # coroutines are cancelled on timeout
+                    call_run(module, client2, float(timeout) if timeout else None)
+            except RunTimeout:
+                metrics.inc("sre_run_timeouts_total", bot=script.stem)
+                raise
+            metrics.observe("sre_run_duration_seconds", time.perf_counter() - started, bot=script.stem)
+            client2.publish(script.name + '/rc', payload=0)
         except Exception as ex:
-            msg = traceback.format_exc()
-            config.logger.error(msg)
-            time.sleep(1)
-        finally:
-            if once:
-                return
+            metrics.observe("sre_run_duration_seconds", time.perf_counter() - started, bot=script.stem)
+            metrics.inc("sre_run_errors_total", bot=script.stem)
+            client2.publish(script.name + '/rc', payload=1)
+            client2.publish(script.name + '/last_error', payload=str(ex))
+            client2.publish('/last_error', payload=f"{script}\n{ex}")
+            config.logger.error(ex)
+
+def _publish_overrun(config, client, script, job):
+    from .mqtt_tools import _get_mqtt_wrapper
+    client2 = _get_mqtt_wrapper(client, get_module(script))
+    client2.publish(script.name + '/overrun', payload=job.overruns)
+
+def schedule_runs(config, client, script, module):
+    from .scheduler import get_scheduler
+    scheduler = get_scheduler()
+    jobs = []
+    try:
+        for cron in getattr(module, 'SCHEDULERS', []):
+            jobs.append(scheduler.add(
+                f"{script.name}:{cron}", cron, lambda: execute_run(config, client, script),
+                overrun=getattr(module, 'OVERRUN', 'skip'),
+                max_concurrent=getattr(module, 'MAX_CONCURRENT_RUNS', 2),
+                on_overrun=lambda job: _publish_overrun(config, client, script, job),
+            ))
+    except Exception:
+        for job in jobs:
+            scheduler.cancel(job)
+        raise
+    return jobs
 
 @cli.command(help="Name of script within search directories")
 @click.argument("name")
 @pass_config
 def test_bot(config, name):
+    from .mqtt_tools import PseudoClient
     name = _get_robot_file(config, name)
 
+    from .aio import call_run
     mod = load_module(name)
-    mod.run(PseudoClient())
+    call_run(mod, PseudoClient())
+
+@cli.command(help="Profiles run() and on_message() of a bot with cProfile")
+@click.argument("name")
+@click.option("-n", "--runs", default=1, help="How often run() is called")
+@click.option("-m", "--message", "messages", nargs=2, multiple=True, metavar="TOPIC PAYLOAD", help="Message passed to on_message")
+@click.option("-f", "--messages-file", type=click.Path(exists=True), help="JSON lines with topic and payload")
+@click.option("-s", "--sort", default="cumulative", help="pstats sort key")
+@click.option("-l", "--limit", default=20, help="Number of functions/allocations shown")
+@click.option("-o", "--dump", help="Write the raw profile to this file")
+@click.option("--memory", is_flag=True, help="Trace allocations with tracemalloc")
+@pass_config
+def profile(config, name, runs, messages, messages_file, sort, limit, dump, memory):
+    from .profiling import profile_bot, _load_messages
+    script = _get_robot_file(config, name)
+    messages = _load_messages(messages, messages_file)
+    profile_bot(config, script, runs, messages, sort, limit, dump, memory)
+
+@cli.command(help="Records messages from the broker into a file for 'replay'")
+@click.argument("file")
+@click.option("-t", "--topic", "topics", multiple=True, help="Topic filter, default '#'")
+@click.option("-d", "--duration", type=float, help="Stop after seconds")
+@click.option("-n", "--count", type=int, help="Stop after messages")
+@pass_config
+def record(config, file, topics, duration, count):
+    from .recording import record
+    record(config, file, topics or ['#'], duration=duration, count=count)
+
+@cli.command(help="Feeds a recording into on_message of a bot")
+@click.argument("name")
+@click.argument("file", type=click.Path(exists=True))
+@click.option("-s", "--speed", default=1.0, help="1 original speed, 10 ten times faster, 0 as fast as possible")
+@pass_config
+def replay(config, name, file, speed):
+    from .recording import replay
+    script = _get_robot_file(config, name)
+    replay(config, script, file, speed)
+
+@cli.command(help="Measures message dispatch, publish, scheduler and daemon hot paths")
+@click.argument("benchmarks", nargs=-1)
+@click.option("-n", "--count", default=10000, help="Messages to process/publish")
+@click.option("-m", "--scripts", default=200, help="Bot scripts for the daemon benchmark")
+@pass_config
+def bench(config, benchmarks, count, scripts):
+    from .bench import run_benchmarks, BENCHMARKS
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            _raise_error(f"Unknown benchmark {name} - available: {', '.join(BENCHMARKS)}")
+    run_benchmarks(config, benchmarks, count, scripts)
 
 @cli.command()
 @click.argument('path', type=click.Path(exists=False))
@@ -158,14 +203,52 @@ def run(config, script, once):
     #if kill_others:
     #    os.system(f"pkill -9 -f '{sys.executable}.*{sys.argv[0]}.*{script}'")
     script = Path(script).absolute()
-    module = load_module(script)
+    if once:
+        module = get_module(script)
+        config.bot = script
+        if not hasattr(module, 'SCHEDULERS'):
+            config.logger.info(f"Module {module} has no schedulers configured. Which is ok, unless it is a typo.")
+        if getattr(module, 'SCHEDULERS', []):
+            with _onetime_client('_run_once', script) as client:
+                os.environ["SRE_OUTPUT_MESSAGES"] = "1"
+                execute_run(config, client, script)
+        return
+    run_bot(config, script)
+
+def run_bot(config, script):
+    from .mqtt_tools import _connect_client, _get_regular_client, on_connect, on_disconnect, on_message
+    from .spool import open_spool
+    module = get_module(script)
     config.logger.info(f"Starting script at {script}")
     config.bot = script
     client = _get_regular_client(config.config['name'], script)
     client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
     client.on_message = on_message
 
+    if not hasattr(module, 'SCHEDULERS'):
+        config.logger.info(f"Module {module} has no schedulers configured. Which is ok, unless it is a typo.")
+
     config.logger.info(f"Connecting to {config.config['broker']}")
+    spool = open_spool(config, client, script.stem)
+    from . import aio
+    if aio.is_async_bot(module):
+        # network i/o of the client runs on the event loop of the async handlers
+        broker = config.config['broker']
+        client.connect_async(broker['ip'], broker.get('port', 1883), 60)
+        metrics.start_flushing(config)
+        schedule_runs(config, client, script, module)
+        aio.drive(client)
+        return
+
+    if spool:
+        # schedules run while the broker is not reachable; messages are spooled
+        broker = config.config['broker']
+        client.connect_async(broker['ip'], broker.get('port', 1883), 60)
+        metrics.start_flushing(config)
+        schedule_runs(config, client, script, module)
+        client.loop_forever(retry_first_connection=True)
+        return
 
     while True:
         try:
@@ -177,53 +260,79 @@ def run(config, script, once):
         else:
             break
 
-    if not hasattr(module, 'SCHEDULERS'):
-        config.logger.info(f"Module {module} has no schedulers configured. Which is ok, unless it is a typo.")
-    for scheduler in getattr(module, 'SCHEDULERS', []):
-        if once:
-            with _onetime_client('_run_once', script) as client:
-                os.environ["SRE_OUTPUT_MESSAGES"] = "1"
-                run_iter(config, client, scheduler, module, once=True)
-            return
-        else:
-            t = threading.Thread(target=run_iter, args=(config, client, scheduler, module, False))
-            t.daemon = False
-            t.start()
-            t.join
+    metrics.start_flushing(config)
+    schedule_runs(config, client, script, module)
     client.loop_forever()
 
 @cli.command(help="Start main loop or sub daemon script (called by service usually)")
+@click.option('--in-process', is_flag=True, help="Run all bots in this process sharing one mqtt connection; bots listed in 'isolated' still get their own process.")
+@click.option('--zygote', is_flag=True, help="Fork bot processes from a preloaded zygote instead of starting new interpreters.")
 @pass_config
-def daemon(config):
+def daemon(config, in_process, zygote):
+    from .webserver import start_webserver
     config.logger.info("Starting daemon...")
+    if zygote:
+        # must be forked before any thread is started
+        from .zygote import Zygote
+        config.zygote = Zygote(config)
+    from .supervisor import Supervisor
+    supervisor = config.supervisor = Supervisor(config)
     t = threading.Thread(target=start_webserver,)
     t.daemon = True
     t.start()
 
+    host = None
+    if in_process:
+        from .host import BotHost
+        host = BotHost(config)
+        host.start()
+
+    from .watcher import get_watcher
+    from .tools import _get_script_index
+    watcher = get_watcher(config)
+    index = _get_script_index(config)
+    scripts = set(index.scripts())
+    for script in sorted(scripts):
+        _update_script(config, host, script, scripts)
+
     while True:
-        for proc in config.processes:
-            if _get_md5(proc.path) != proc.md5:
-                config.logger.info(f"Script was changed, restarting: {proc.path}")
-                kill_proc(proc, 1)
-                start_proc(config, proc.path)
-
-        for script in iterate_scripts(config):
-            if str(script) in config.config.get('disabled', []):
-                continue
-            if not [x for x in config.processes if x.path == script]:
-                config.logger.info(f"Detected new script: {script}")
-                start_proc(config, script)
-
-        for proc in config.processes:
-            if not [x for x in list(iterate_scripts(config)) if x == proc.path]:
-                config.logger.info(f"Detected removal of script: {script}")
-                kill_proc(proc, 1)
-
-        time.sleep(2)
+        changed = watcher.wait(timeout=supervisor.timeout(2), wakeup=supervisor.wakeup_fd)
+        supervisor.tick()
+        if not changed:
+            continue
+        index.update(changed)
+        scripts = set(index.scripts())
+        for path in sorted(changed):
+            _update_script(config, host, path, scripts)
+
+def _update_script(config, host, path, scripts):
+    supervisor = config.supervisor
+    supervised = path in supervisor
+    hosted = host and path in host
+    if supervised or hosted:
+        if path not in scripts:
+            config.logger.info(f"Detected removal of script: {path}")
+            if supervised:
+                supervisor.remove(path)
+            else:
+                host.remove(path)
+        elif supervised:
+            if _get_md5(path) != supervisor.get_md5(path):
+                config.logger.info(f"Script was changed, restarting: {path}")
+                metrics.inc("sre_bot_restarts_total", bot=path.stem)
+                supervisor.restart(path)
+        elif not host.reload(path):
+            supervisor.start(path)
+
+    elif path in scripts and str(path) not in config.config.get('disabled', []):
+        config.logger.info(f"Detected new script: {path}")
+        if not host or str(path) in config.config.get('isolated', []) or not host.add(path):
+            supervisor.start(path)
 
 @cli.command(name="state")
 @pass_config
 def state(config):
+    import inquirer
     scripts = list(sorted(map(str, iterate_scripts(config))))
     defaults = []
     for script in scripts:
@@ -1,6 +1,5 @@
 import atexit
 import click
-import logging
 from pathlib import Path
 import sys
 from .tools import _raise_error, cleanup
@@ -12,31 +11,17 @@ class Config(object):
         super().__init__()
         self.config_file = Path(config_file or '/etc/sre/sre.conf')
         self.current_dir = Path(sys.path[0])
-        self.processes = []
+        self.supervisor = None
+        self.script_index = None
+        self.zygote = None
         self.load_config()
         self.setup_logging()
         self.bot = False
         atexit.register(cleanup)
 
     def setup_logging(self):
-        log_level = (self.config.get('log_level') or 'INFO').upper()
-        FORMAT = '[%(levelname)s] %(asctime)s %(message)s'
-        formatter = logging.Formatter(FORMAT)
-        logging.basicConfig(format=FORMAT)
-        self.logger = logging.getLogger('')  # root handler
-        self.logger.setLevel(log_level)
-
-        if self.config.get('log_file'):
-            log_file = Path(self.config.get('log_file'))
-            log_file.parent.mkdir(exist_ok=True, parents=True)
-            output_file_handler = logging.FileHandler(log_file)
-            output_file_handler.setFormatter(formatter)
-            self.logger.addHandler(output_file_handler)
-            del log_file
-
-        stdout_handler = logging.StreamHandler(sys.stdout)
-        self.logger.addHandler(stdout_handler)
-        stdout_handler.setFormatter(formatter)
+        from .log_tools import setup_logging
+        self.logger = setup_logging(self)
 
     def store_config(self):
         self.config_file.write_text(
@@ -52,15 +37,26 @@ class Config(object):
                 _raise_error(f"config file corrupt:\n\n{ex}\n\n" + self.config_file.read_text())
         else: config = {}
 
-        self._set_default_values(config)
         self.config = config
+        if self._set_default_values(config):
+            self.config_file.parent.mkdir(parents=True, exist_ok=True)
+            self.store_config()
 
     def _set_default_values(self, config):
-        config.setdefault('bots-paths', [])
-        config.setdefault('name', socket.gethostname())
-        config.setdefault('log_level', 'info')
-        self.config_file.parent.mkdir(parents=True, exist_ok=True)
-        self.config_file.write_text(json.dumps(config, indent=4))
+        """
+        Returns True if a default was added, so the file is only written
+        when it actually changes.
+        """
+        changed = False
+        for key, value in [
+            ('bots-paths', []),
+            ('name', socket.gethostname()),
+            ('log_level', 'info'),
+        ]:
+            if key not in config:
+                config[key] = value
+                changed = True
+        return changed
 
 
 pass_config = click.make_pass_decorator(Config, ensure=True)
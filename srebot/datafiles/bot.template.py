@@ -1,12 +1,25 @@
 # SCHEDULERS = ["* * * * * */1"]
 # HOSTNAME = 'host1'
+# SUBSCRIPTIONS = ["trigger/zabbix/#", ("house/+/state", 1)]
+# WORKER_GROUP = "zabbix"  # instances on several hosts share the messages
+# RUN_TIMEOUT = 30  # run() then executes in a forked process: changes to globals are lost
+# OVERRUN = "skip"  # or "coalesce", "concurrent" (with MAX_CONCURRENT_RUNS = 2)
+# PUBLISH_ON_CHANGE = {"deadband": 0.5, "max_silence": 300}
+# LAZY_PAYLOAD = True  # handlers get a read-only Payload decoded on first access
 
 def run(client):
     # client.publish('house/bulb1', 'on')
     pass
 
-def on_message(client, msg, payload=None):
-    print(msg.topic)
+# receives the topics in SUBSCRIPTIONS
+# def on_message(client, msg, payload=None):
+#     print(msg.topic)
+
+
+# from srebot import on
+# @on("trigger/+/restart")
+# def restart(client, msg, payload=None):
+#     pass
 
 
 def install():
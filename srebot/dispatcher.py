@@ -0,0 +1,145 @@
+import queue
+import threading
+import time
+import traceback
+import zlib
+from . import global_data
+
+OVERFLOW_POLICIES = ("block", "drop-new", "drop-oldest")
+
+
+class Dispatcher(object):
+    """
+    Runs on_message handlers in a pool of worker threads, so slow handlers
+    do not block the network loop of the mqtt client.
+
+    ordered: messages of the same topic are always handled by the same
+             worker and therefore in order of arrival.
+    overflow: what happens if the queue is full:
+              block - wait for free space (backpressure to the mqtt client)
+              drop-new - discard the incoming message
+              drop-oldest - discard the oldest queued message
+    """
+
+    def __init__(
+        self, workers=1, queue_size=1000, ordered=True, overflow="block", stats_interval=60
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+        self.ordered = ordered
+        self.overflow = overflow
+        self.stats_interval = stats_interval
+        self.queues = [queue.Queue(queue_size) for _ in range(workers if ordered else 1)]
+        self.lock = threading.Lock()
+        self._reset_stats()
+        self.last_report = time.monotonic()
+        for i in range(workers):
+            t = threading.Thread(
+                target=self._work, args=(self.queues[i % len(self.queues)],), name=f"dispatch-{i}"
+            )
+            t.daemon = True
+            t.start()
+
+    def _reset_stats(self):
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.latency_sum = 0.0
+        self.max_latency = 0.0
+
+    def _get_queue(self, key):
+        if len(self.queues) == 1:
+            return self.queues[0]
+        return self.queues[zlib.crc32(key.encode()) % len(self.queues)]
+
+    def submit(self, key, func, *args):
+        q = self._get_queue(key)
+        item = (time.monotonic(), key, func, args)
+        with self.lock:
+            self.submitted += 1
+        try:
+            if self.overflow == "block":
+                q.put(item)
+            else:
+                q.put_nowait(item)
+        except queue.Full:
+            dropped, queued = [], False
+            if self.overflow == "drop-oldest":
+                try:
+                    dropped.append(q.get_nowait()[1])
+                    q.task_done()
+                except queue.Empty:
+                    pass
+                try:
+                    q.put_nowait(item)
+                    queued = True
+                except queue.Full:
+                    # refilled by another thread meanwhile
+                    pass
+            if not queued:
+                dropped.append(key)
+            with self.lock:
+                self.dropped += len(dropped)
+            for x in dropped:
+                global_data["config"].logger.warning(f"Dispatch queue full - dropped message for {x}")
+            if not queued:
+                return False
+        with self.lock:
+            self.max_depth = max(self.max_depth, q.qsize())
+        return True
+
+    def _work(self, q):
+        while True:
+            queued, key, func, args = q.get()
+            latency = time.monotonic() - queued
+            try:
+                func(*args)
+            except Exception:
+                global_data["config"].logger.error(traceback.format_exc())
+            finally:
+                q.task_done()
+            with self.lock:
+                self.processed += 1
+                self.latency_sum += latency
+                self.max_latency = max(self.max_latency, latency)
+            self._report()
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _report(self):
+        now = time.monotonic()
+        if now - self.last_report < self.stats_interval:
+            return
+        with self.lock:
+            if now - self.last_report < self.stats_interval:
+                return
+            self.last_report = now
+            avg = self.latency_sum / self.processed if self.processed else 0
+            msg = (
+                f"Dispatch stats: {self.submitted} submitted, {self.processed} processed, "
+                f"{self.dropped} dropped, queue depth {self.depth()} (max {self.max_depth}), "
+                f"queue latency avg {avg * 1000:.1f}ms max {self.max_latency * 1000:.1f}ms"
+            )
+            self._reset_stats()
+        global_data["config"].logger.info(msg)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if not _dispatcher:
+            settings = global_data["config"].config.get("dispatch", {})
+            _dispatcher = Dispatcher(
+                workers=int(settings.get("workers", 1)),
+                queue_size=int(settings.get("queue_size", 1000)),
+                ordered=bool(settings.get("ordered", True)),
+                overflow=settings.get("overflow", "block"),
+                stats_interval=float(settings.get("stats_interval", 60)),
+            )
+    return _dispatcher
@@ -0,0 +1,182 @@
+import threading
+import traceback
+from pathlib import Path
+from . import metrics
+from .tools import get_module, _get_md5
+from .scheduler import get_scheduler
+from .dispatcher import get_dispatcher
+from .spool import open_spool, get_spool
+from .mqtt_tools import (
+    _get_regular_client, _get_subscriptions, _handle_message, _reduce_subscriptions, TopicTrie
+)
+
+
+class HostedBot(object):
+    def __init__(self, path):
+        self.path = path
+        self.module = None
+        self.md5 = None
+        self.subscriptions = []
+        self.jobs = []
+
+
+class BotHost(object):
+    """
+    Runs several bots in one interpreter. All bots share a single mqtt client;
+    messages and schedules are dispatched per bot, so an exception or reload
+    in one bot does not affect the others.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.bots = {}
+        self.subscribed = {}
+        self.router = TopicTrie()
+        self.lock = threading.RLock()
+        self.client = _get_regular_client(config.config["name"], Path("in-process"))
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        open_spool(config, self.client, "in-process")
+
+    def start(self):
+        broker = self.config.config["broker"]
+        self.config.logger.info(f"Connecting to {broker}")
+        self.client.connect_async(broker["ip"], broker.get("port", 1883), 60)
+        self.client.loop_start()
+
+    def __contains__(self, path):
+        return path in self.bots
+
+    def add(self, path):
+        """
+        Returns False for bots that need their own process: with a
+        WORKER_GROUP the shared client could receive a message twice.
+        """
+        with self.lock:
+            bot = HostedBot(path)
+            self._load(bot)
+            if getattr(bot.module, "WORKER_GROUP", None):
+                self._cancel_jobs(bot)
+                return False
+            self.config.logger.info(f"Loaded {path} in-process")
+            self.bots[path] = bot
+            self._sync_subscriptions()
+        return True
+
+    def remove(self, path):
+        self.config.logger.info(f"Unloading {path}")
+        with self.lock:
+            bot = self.bots.pop(path)
+            self._cancel_jobs(bot)
+            self._sync_subscriptions()
+
+    def reload(self, path):
+        """
+        Returns False if the bot was removed because it declares a
+        WORKER_GROUP now; it has to be started in its own process.
+        """
+        with self.lock:
+            bot = self.bots[path]
+            if bot.module and _get_md5(path) == bot.md5:
+                return True
+            module = bot.module
+            self._load(bot)
+            if bot.module is not module:
+                self.config.logger.info(f"Script was changed, reloaded: {path}")
+                metrics.inc("sre_bot_restarts_total", bot=path.stem)
+            if getattr(bot.module, "WORKER_GROUP", None):
+                self.config.logger.info(f"Unloading {path}: WORKER_GROUP needs its own process")
+                del self.bots[path]
+                self._cancel_jobs(bot)
+                self._sync_subscriptions()
+                return False
+            self._sync_subscriptions()
+        return True
+
+    def _cancel_jobs(self, bot):
+        for job in bot.jobs:
+            get_scheduler().cancel(job)
+        bot.jobs = []
+
+    def _load(self, bot):
+        from .bot import schedule_runs
+
+        bot.md5 = _get_md5(bot.path)
+        try:
+            module = get_module(bot.path)
+        except Exception:
+            self.config.logger.error(
+                f"Could not load {bot.path}:\n{traceback.format_exc()}"
+            )
+            return
+        if module is bot.module:
+            return
+
+        self._cancel_jobs(bot)
+        bot.module = module
+        try:
+            bot.subscriptions = _get_subscriptions(module)
+        except Exception:
+            bot.subscriptions = []
+            self.config.logger.error(
+                f"Invalid SUBSCRIPTIONS in {bot.path}:\n{traceback.format_exc()}"
+            )
+
+        try:
+            bot.jobs = schedule_runs(self.config, self.client, bot.path, module)
+        except Exception:
+            self.config.logger.error(
+                f"Invalid SCHEDULERS in {bot.path}:\n{traceback.format_exc()}"
+            )
+
+    def _get_wanted_subscriptions(self):
+        # overlapping filters of different bots would deliver a message
+        # once per filter, and every copy is routed to all matching bots
+        return dict(_reduce_subscriptions(
+            x for bot in self.bots.values() for x in bot.subscriptions
+        ))
+
+    def _sync_subscriptions(self):
+        self.router = TopicTrie(
+            (topic, bot)
+            for bot in self.bots.values()
+            if bot.module
+            for topic, qos in bot.subscriptions
+        )
+        wanted = self._get_wanted_subscriptions()
+        obsolete = [topic for topic in self.subscribed if topic not in wanted]
+        new = [
+            (topic, qos)
+            for topic, qos in wanted.items()
+            if self.subscribed.get(topic) != qos
+        ]
+        self.subscribed = wanted
+        if not self.client.is_connected():
+            # on_connect subscribes everything
+            return
+        if obsolete:
+            self.client.unsubscribe(obsolete)
+        if new:
+            self.client.subscribe(new)
+
+    def on_connect(self, client, userdata, flags, reason, properties):
+        self.config.logger.debug("Client connected")
+        metrics.inc("sre_mqtt_connects_total", client="in-process")
+        spool = get_spool(client)
+        if spool:
+            spool.start_drain(client)
+        with self.lock:
+            self.subscribed = self._get_wanted_subscriptions()
+            if self.subscribed:
+                client.subscribe(list(self.subscribed.items()))
+
+    def on_disconnect(self, client, userdata, reason, properties=None):
+        self.config.logger.warning(f"Disconnected from broker: {reason}")
+        metrics.inc("sre_mqtt_disconnects_total", client="in-process")
+
+    def on_message(self, client, userdata, msg):
+        dispatcher = get_dispatcher()
+        for bot in self.router.match(msg.topic):
+            if bot.module:
+                dispatcher.submit(msg.topic, _handle_message, client, bot.module, msg)
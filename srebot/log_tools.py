@@ -0,0 +1,178 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+FORMAT = '[%(levelname)s] %(asctime)s %(message)s'
+
+_listener = None
+_handlers = []
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line.
+    """
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops warnings/errors repeating the same message within dedup_interval
+    seconds (reported as 'repeated n times' with the next one) and limits
+    the process to rate records per second with bursts up to burst.
+    """
+
+    def __init__(self, rate=100, burst=200, dedup_interval=60):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.dedup_interval = float(dedup_interval)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.dropped = 0
+        self.recent = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        now = time.monotonic()
+        message = record.getMessage()
+        record.msg, record.args = message, None
+        repeated = 0
+        with self.lock:
+            if record.levelno >= logging.WARNING:
+                key = (record.levelno, message)
+                seen = self.recent.get(key)
+                if seen and now - seen[0] < self.dedup_interval:
+                    seen[1] += 1
+                    return False
+                repeated = seen[1] if seen else 0
+                if len(self.recent) > 1000:
+                    self.recent = {
+                        k: v for k, v in self.recent.items() if now - v[0] < self.dedup_interval
+                    }
+                self.recent[key] = [now, 0]
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.dropped += 1
+                return False
+            self.tokens -= 1
+            dropped, self.dropped = self.dropped, 0
+
+        if repeated or dropped:
+            if repeated:
+                record.msg += f" (repeated {repeated} times)"
+            if dropped:
+                record.msg += f" ({dropped} log messages dropped by rate limit)"
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records into the queue of the background writer. Only the message
+    is rendered in the logging thread (arguments may change later);
+    formatting and I/O happen in the writer thread.
+    """
+
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def _get_handlers(config):
+    settings = config.config
+    if settings.get('log_format') == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if settings.get('log_file'):
+        log_file = Path(settings.get('log_file'))
+        log_file.parent.mkdir(exist_ok=True, parents=True)
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def _start_listener():
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, *_handlers)
+    _listener.start()
+    return log_queue
+
+
+def _after_fork():
+    # the writer thread does not exist in the child and a lock held by
+    # another thread at fork time would never be released
+    for handler in logging.getLogger('').handlers:
+        if isinstance(handler, LazyQueueHandler):
+            for filter in handler.filters:
+                if isinstance(filter, RateLimitFilter):
+                    filter.lock = threading.Lock()
+            if _listener:
+                handler.queue = _start_listener()
+
+
+def setup_logging(config):
+    """
+    Root logger writes through a queue; stdout/file handlers run in a
+    background thread so logging never blocks the mqtt or worker threads.
+    """
+    global _handlers
+    logger = logging.getLogger('')
+    logger.setLevel((config.config.get('log_level') or 'INFO').upper())
+    stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, LazyQueueHandler):
+            logger.removeHandler(handler)
+
+    _handlers = _get_handlers(config)
+    handler = LazyQueueHandler(_start_listener())
+    handler.addFilter(RateLimitFilter(
+        rate=config.config.get('log_rate', 100),
+        burst=config.config.get('log_burst', 200),
+        dedup_interval=config.config.get('log_dedup_interval', 60),
+    ))
+    logger.addHandler(handler)
+    return logger
+
+
+def stop():
+    """
+    Writes pending records; call before os._exit.
+    """
+    global _listener
+    if _listener:
+        listener, _listener = _listener, None
+        listener.stop()
+
+
+atexit.register(stop)
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,170 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+
+METRICS = {
+    "sre_run_duration_seconds": ("histogram", "Duration of run() calls"),
+    "sre_run_errors_total": ("counter", "run() calls that raised an exception"),
+    "sre_run_timeouts_total": ("counter", "run() calls aborted after RUN_TIMEOUT"),
+    "sre_run_overruns_total": ("counter", "Scheduled runs due while the previous run was still active"),
+    "sre_on_message_duration_seconds": ("histogram", "Duration of on_message() calls"),
+    "sre_messages_received_total": ("counter", "Messages passed to on_message"),
+    "sre_messages_published_total": ("counter", "Messages published by a bot"),
+    "sre_messages_suppressed_total": ("counter", "Unchanged messages not published (PUBLISH_ON_CHANGE)"),
+    "sre_mqtt_connects_total": ("counter", "Successful (re)connects to the broker"),
+    "sre_mqtt_disconnects_total": ("counter", "Connection losses to the broker"),
+    "sre_scheduler_lag_seconds": ("histogram", "Delay between scheduled and actual start of run()"),
+    "sre_bot_restarts_total": ("counter", "Restarts/reloads of a bot by the daemon"),
+    "sre_bot_crashes_total": ("counter", "Unexpected exits of a bot process"),
+    "sre_bot_crash_loops_total": ("counter", "Times a bot was detected crash looping"),
+}
+
+
+class Registry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if not histogram:
+                histogram = self.histograms[key] = [[0] * (len(DURATION_BUCKETS) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+                "histograms": [
+                    [name, labels, list(buckets), total, count]
+                    for (name, labels), (buckets, total, count) in self.histograms.items()
+                ],
+            }
+
+
+registry = Registry()
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, labels, value)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, labels, value)
+
+
+def _get_metrics_dir(config):
+    return Path(
+        config.config.get("metrics_dir")
+        or Path(tempfile.gettempdir()) / f"sre-metrics-{config.config['name']}"
+    )
+
+
+def start_flushing(config, interval=10):
+    """
+    Bot subprocesses write their metrics periodically to the metrics dir,
+    where the daemon's webserver collects them.
+    """
+    path = _get_metrics_dir(config)
+    path.mkdir(parents=True, exist_ok=True)
+    filename = path / f"{os.getpid()}.json"
+
+    def flush():
+        while True:
+            time.sleep(interval)
+            tmp = filename.with_suffix(".tmp")
+            tmp.write_text(json.dumps(registry.snapshot()))
+            tmp.replace(filename)
+
+    t = threading.Thread(target=flush, name="metrics")
+    t.daemon = True
+    t.start()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _collect_snapshots(config):
+    snapshots = [registry.snapshot()]
+    path = _get_metrics_dir(config)
+    if not path.exists():
+        return snapshots
+    for file in path.glob("*.json"):
+        if not file.stem.isdigit():
+            continue
+        if not _is_alive(int(file.stem)):
+            file.unlink()
+            continue
+        try:
+            snapshots.append(json.loads(file.read_text()))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, **extra):
+    labels = [(k, v) for k, v in labels] + list(extra.items())
+    if not labels:
+        return ""
+    values = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + values + "}"
+
+
+def render(config):
+    counters = {}
+    histograms = {}
+    for snapshot in _collect_snapshots(config):
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+
+    lines = []
+    for name, (kind, help) in METRICS.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (key, labels), value in sorted(counters.items()):
+            if key == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (key, labels), (buckets, total, count) in sorted(histograms.items()):
+            if key != name:
+                continue
+            cumulative = 0
+            for le, bucket in zip(list(DURATION_BUCKETS) + ["+Inf"], buckets):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(labels, le=le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
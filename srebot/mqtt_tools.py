@@ -1,9 +1,16 @@
 import traceback
+import inspect
 import os
+import threading
+import time
+import weakref
+from collections.abc import Mapping
 from . import global_data
+from . import metrics
+from .spool import get_spool
 from pathlib import Path
-import arrow
 import json
+from datetime import datetime, timezone
 import click
 import paho.mqtt.client as mqtt
 
@@ -12,41 +19,191 @@ class PseudoClient(object):
     def __init__(self):
         pass
 
-    def publish(self, path, payload=None, qos=0):
+    def publish(self, path, payload=None, qos=0, retain=False):
         print(f"{path}:{qos}: {payload}")
 
+    def publish_many(self, items, qos=0, retain=False):
+        return [
+            self.publish(
+                item[0],
+                payload=item[1],
+                qos=item[2] if len(item) > 2 else qos,
+                retain=item[3] if len(item) > 3 else retain,
+            )
+            for item in items
+        ]
+
+
+try:
+    import orjson
+
+    _fast_dumps = orjson.dumps
+    _fast_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+
+        _fast_dumps = ujson.dumps
+        _fast_loads = ujson.loads
+    except ImportError:
+        _fast_dumps = json.dumps
+        _fast_loads = json.loads
+
+
+def _dumps(value):
+    try:
+        return _fast_dumps(value)
+    except (TypeError, ValueError, OverflowError):
+        # let stdlib json decide/raise for types the fast serializers reject
+        return json.dumps(value)
+
+
+def _utcnow():
+    # same format as str(arrow.get().to("utc")) at a fraction of the cost
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ChangeFilter(object):
+    """
+    Last published value per topic for PUBLISH_ON_CHANGE: a value equal to
+    the last published one (numbers: within the deadband) is suppressed,
+    unless nothing was published on the topic for max_silence seconds.
+    """
+
+    def __init__(self, deadband=0, max_silence=300, topics=None):
+        self.deadband = float(deadband)
+        self.max_silence = float(max_silence)
+        self.topics = [topics] if isinstance(topics, str) else list(topics or [])
+        self.last = {}
+        self.lock = threading.Lock()
+        self.suppressed = 0
+
+    def changed(self, topic, value):
+        if self.topics and not any(mqtt.topic_matches_sub(x, topic) for x in self.topics):
+            return True
+        if not _is_number(value):
+            # compare serialized; the bot may mutate and republish one dict
+            value = _dumps(value)
+        now = time.monotonic()
+        with self.lock:
+            last = self.last.get(topic)
+            if last and now - last[1] < self.max_silence:
+                if _is_number(value) and _is_number(last[0]):
+                    unchanged = abs(value - last[0]) <= self.deadband
+                else:
+                    unchanged = value == last[0]
+                if unchanged:
+                    self.suppressed += 1
+                    return False
+            self.last[topic] = (value, now)
+        return True
+
+
+_change_filters = {}
+
+
+def _get_change_filter(module):
+    settings = getattr(module, "PUBLISH_ON_CHANGE", None)
+    if not settings:
+        return None
+    if settings is True:
+        settings = {}
+    cached = _change_filters.get(module.__file__)
+    if not cached or cached[0] != settings:
+        cached = _change_filters[module.__file__] = (settings, ChangeFilter(**settings))
+    return cached[1]
+
 
 class mqttwrapper(object):
-    def __init__(self, client, hostname, modulename):
+    def __init__(self, client, hostname, modulename, change_filter=None):
         self.client = client
         self.hostname = hostname
         self.logger = global_data["config"].logger
         self.modulename = modulename
+        self.output_messages = os.getenv("SRE_OUTPUT_MESSAGES") == "1"
+        self.spool = get_spool(client)
+        self.change_filter = change_filter
 
-    def publish(self, path, payload=None, qos=0, retain=False):
-        path = self.hostname + "/" + path
+    def _is_suppressed(self, path, value):
+        if self.change_filter and not self.change_filter.changed(path, value["value"]):
+            metrics.inc("sre_messages_suppressed_total", bot=self.modulename)
+            return True
+        return False
 
-        def _get(keyname, default):
-            if isinstance(payload, dict) and keyname in payload:
-                return payload[keyname]
-            return default
+    def _publish(self, path, payload, qos, retain):
+        if self.spool and not self.client.is_connected():
+            self.spool.put(path, payload, qos, retain)
+            return None
+        return self.client.publish(path, payload=payload, qos=qos, retain=retain)
 
-        timestamp = _get("timestamp", str(arrow.get().to("utc")))
-        if not isinstance(timestamp, str):
-            timestamp = str(timestamp)
+    def _make_envelope(self, path, payload, timestamp):
+        if isinstance(payload, Payload):
+            # republishing a received message
+            payload = payload._get_envelope()
+        value = payload
+        if isinstance(payload, dict):
+            value = payload.get("value", payload)
+            timestamp = payload.get("timestamp", timestamp)
+            if not isinstance(timestamp, str):
+                timestamp = str(timestamp)
 
-        value = {
+        return self.hostname + "/" + path, {
             "module": self.modulename,
-            "value": _get("value", payload),
+            "value": value,
             # cannot use msg.timestamp - they use time.monotonic() which results
             # in consecutive calls results starting from 1970
-            "timestamp": _get("timestamp", timestamp),
+            "timestamp": timestamp,
         }
-        self.output_to_console(path, value)
-        self.client.publish(path, payload=json.dumps(value), qos=qos, retain=retain)
+
+    def publish(self, path, payload=None, qos=0, retain=False):
+        """
+        Returns paho's MQTTMessageInfo; None if the message was spooled or
+        suppressed by PUBLISH_ON_CHANGE.
+        """
+        topic, value = self._make_envelope(path, payload, _utcnow())
+        if self._is_suppressed(path, value):
+            return None
+        path = topic
+        if self.output_messages:
+            self.output_to_console(path, value)
+        metrics.inc("sre_messages_published_total", bot=self.modulename)
+        return self._publish(path, _dumps(value), qos, retain)
+
+    def publish_many(self, items, qos=0, retain=False):
+        """
+        Publishes several messages with one shared timestamp. Items are
+        (path, payload) or (path, payload, qos, retain) tuples.
+        """
+        timestamp = _utcnow()
+        result = []
+        published = 0
+        for item in items:
+            path, payload = item[0], item[1]
+            topic, value = self._make_envelope(path, payload, timestamp)
+            if self._is_suppressed(path, value):
+                result.append(None)
+                continue
+            path = topic
+            published += 1
+            if self.output_messages:
+                self.output_to_console(path, value)
+            result.append(
+                self._publish(
+                    path,
+                    _dumps(value),
+                    item[2] if len(item) > 2 else qos,
+                    item[3] if len(item) > 3 else retain,
+                )
+            )
+        metrics.inc("sre_messages_published_total", published, bot=self.modulename)
+        return result
 
     def output_to_console(self, path, value):
-        if os.getenv("SRE_OUTPUT_MESSAGES") != "1":
+        if not self.output_messages:
             return
         try:
             value = json.dumps(value, indent=4)
@@ -61,13 +218,75 @@ class mqttwrapper(object):
         click.secho(msg, fg="cyan")
 
 
+class PublishTracker(object):
+    """
+    Tracks acknowledgements (on_publish) of a client per message id.
+    """
+
+    # acknowledged message ids nobody waited for (yet)
+    max_done = 10000
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.done = {}
+        self.previous = getattr(client, "on_publish", None)
+        client.on_publish = self.on_publish
+
+    def on_publish(self, client, userdata, mid):
+        with self.lock:
+            callback = self.pending.pop(mid, None)
+            if not callback:
+                # acknowledged before the publisher started waiting
+                self.done[mid] = True
+                if len(self.done) > self.max_done:
+                    del self.done[next(iter(self.done))]
+        if callback:
+            callback()
+        if self.previous:
+            self.previous(client, userdata, mid)
+
+    def track(self, mid, callback):
+        """
+        Calls callback (from the network thread) when mid is acknowledged.
+        """
+        with self.lock:
+            acknowledged = self.done.pop(mid, False)
+            if not acknowledged:
+                self.pending[mid] = callback
+        if acknowledged:
+            callback()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """
+        Returns threading.Event which is set when the message is acknowledged.
+        """
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        event = threading.Event()
+        self.track(info.mid, event.set)
+        return event
+
+
+_trackers = weakref.WeakKeyDictionary()
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(client):
+    with _trackers_lock:
+        tracker = _trackers.get(client)
+        if tracker is None:
+            tracker = _trackers[client] = PublishTracker(client)
+    return tracker
+
+
 def _get_mqtt_wrapper(client, module):
     from . import global_data
 
     name = global_data["config"].config["name"]
     _name = getattr(module, "HOSTNAME", name) if module else name
     _modulename = Path(module.__file__).stem
-    return mqttwrapper(client, _name, _modulename)
+    return mqttwrapper(client, _name, _modulename, _get_change_filter(module))
 
 
 def _get_regular_client(name, scriptfile):
@@ -84,33 +303,341 @@ def _connect_client(client):
     )
 
 
+_NOT_DECODED = object()
+
+
+class Payload(Mapping):
+    """
+    Payload passed to the message handlers of bots with LAZY_PAYLOAD = True;
+    other bots get decode(). JSON is decoded on first access and cached;
+    payloads that are no JSON object look like the sre envelope
+    {"value": raw bytes, "timestamp": time of receipt, "module": None}.
+    """
+
+    __slots__ = ("_raw", "_received", "_data", "_envelope")
+
+    def __init__(self, raw, received=None):
+        self._raw = raw
+        self._received = time.time() if received is None else received
+        self._data = _NOT_DECODED
+        self._envelope = None
+
+    @property
+    def raw(self):
+        """
+        The undecoded payload without copying it.
+        """
+        return memoryview(self._raw)
+
+    @property
+    def data(self):
+        """
+        The decoded JSON of any type; raises ValueError for invalid JSON.
+        """
+        if self._data is _NOT_DECODED:
+            self._data = _fast_loads(self._raw)
+        return self._data
+
+    def _get_envelope(self):
+        if self._envelope is None:
+            try:
+                data = self.data
+            except (ValueError, TypeError):
+                data = None
+            if isinstance(data, dict):
+                self._envelope = data
+            else:
+                self._envelope = {
+                    "value": self._raw if data is None else data,
+                    "timestamp": datetime.fromtimestamp(self._received, timezone.utc).isoformat(),
+                    "module": None,
+                }
+        return self._envelope
+
+    def decode(self):
+        """
+        The payload as handlers get it without LAZY_PAYLOAD: the decoded JSON
+        of any type, or the envelope dict if it is no JSON.
+        """
+        try:
+            return self.data
+        except (ValueError, TypeError):
+            return dict(self._get_envelope())
+
+    @property
+    def value(self):
+        return self._get_envelope().get("value")
+
+    @property
+    def timestamp(self):
+        return self._get_envelope().get("timestamp")
+
+    @property
+    def module(self):
+        return self._get_envelope().get("module")
+
+    def __getitem__(self, key):
+        return self._get_envelope()[key]
+
+    def __iter__(self):
+        return iter(self._get_envelope())
+
+    def __len__(self):
+        return len(self._get_envelope())
+
+    def __repr__(self):
+        if self._envelope is None:
+            return f"<Payload {len(self._raw)} bytes, not decoded>"
+        return f"<Payload {self._envelope!r}>"
+
+
+def _strip_share(topic):
+    """
+    Filter of a shared subscription '$share/<group>/<filter>'.
+    """
+    if topic.startswith("$share/"):
+        return topic.split("/", 2)[2]
+    return topic
+
+
+class TopicTrie(object):
+    """
+    MQTT topic filters compiled into a trie with one node per topic level;
+    matching walks only the branches of the topic's levels, '+' and '#'.
+    """
+
+    def __init__(self, items=()):
+        # node: [children by level, values]
+        self.root = [{}, []]
+        for topic, value in items:
+            self.add(topic, value)
+
+    def add(self, topic, value):
+        topic = _strip_share(topic)
+        node = self.root
+        for level in topic.split("/"):
+            node = node[0].setdefault(level, [{}, []])
+        node[1].append(value)
+
+    def match(self, topic):
+        """
+        Returns the values of all matching filters without duplicates.
+        """
+        levels = topic.split("/")
+        result = []
+        # wildcards at the first level do not match $SYS/... topics
+        stack = [(self.root, 0, topic.startswith("$"))]
+        while stack:
+            node, i, no_wildcards = stack.pop()
+            children = node[0]
+            if "#" in children and not no_wildcards:
+                result.extend(children["#"][1])
+            if i == len(levels):
+                result.extend(node[1])
+                continue
+            child = children.get(levels[i])
+            if child:
+                stack.append((child, i + 1, False))
+            child = children.get("+")
+            if child and not no_wildcards:
+                stack.append((child, i + 1, False))
+        if len(result) > 1:
+            result = list(dict.fromkeys(result))
+        return result
+
+
+def _get_handlers(module):
+    """
+    Functions of the bot decorated with @on(topic).
+    """
+    return [
+        x
+        for x in vars(module).values()
+        if callable(x) and getattr(x, "sre_topics", None)
+    ]
+
+
+_routers = weakref.WeakKeyDictionary()
+
+
+def _get_router(module):
+    """
+    Trie of the bot's handlers: @on functions under their filters and
+    on_message under SUBSCRIPTIONS. Built once per loaded module.
+    """
+    router = _routers.get(module)
+    if router is None:
+        router = TopicTrie()
+        if getattr(module, "on_message", None):
+            for topic, qos in _get_declared_subscriptions(module):
+                router.add(topic, module.on_message)
+        for handler in _get_handlers(module):
+            for topic, qos in handler.sre_topics:
+                router.add(topic, handler)
+        _routers[module] = router
+    return router
+
+
+def _get_subscriptions(module):
+    """
+    Returns list of (topic, qos) tuples: SUBSCRIPTIONS of on_message and the
+    filters of @on handlers without overlaps, so each message arrives once
+    and is routed to all matching handlers; as '$share/<WORKER_GROUP>/<filter>'
+    if the bot declares a WORKER_GROUP, so the broker hands each message to
+    one member.
+    """
+    result = {}
+    if getattr(module, "on_message", None):
+        for topic, qos in _get_declared_subscriptions(module):
+            result[topic] = max(qos, result.get(topic, 0))
+    for handler in _get_handlers(module):
+        for topic, qos in handler.sre_topics:
+            result[topic] = max(qos, result.get(topic, 0))
+    group = getattr(module, "WORKER_GROUP", None)
+    if group:
+        if any(x in group for x in "/+#"):
+            raise ValueError(f"WORKER_GROUP must not contain '/', '+' or '#': {group}")
+        return [
+            (f"$share/{group}/{_strip_share(topic)}", qos)
+            for topic, qos in _reduce_subscriptions(result.items())
+        ]
+    return _reduce_subscriptions(result.items())
+
+
+def _covers(a, b):
+    """
+    True if every topic matching filter b also matches filter a.
+    """
+    a, b = a.split("/"), b.split("/")
+    for i, level in enumerate(a):
+        if level == "#":
+            # wildcards at the first level do not match $SYS/... topics
+            return i > 0 or not b[0].startswith("$")
+        if i == len(b) or b[i] == "#":
+            return False
+        if level == "+":
+            if not i and b[0].startswith("$"):
+                return False
+        elif level != b[i]:
+            return False
+    return len(a) == len(b)
+
+
+def _reduce_subscriptions(subscriptions):
+    """
+    Drops filters covered by another one - the broker would deliver a copy
+    of a message per matching subscription. The remaining filter gets the
+    highest qos.
+    """
+    kept = {}
+    for topic, qos in subscriptions:
+        covering = next((x for x in kept if _covers(x, topic)), None)
+        if covering is not None:
+            kept[covering] = max(qos, kept[covering])
+            continue
+        for x in [x for x in kept if _covers(topic, x)]:
+            qos = max(qos, kept.pop(x))
+        kept[topic] = qos
+    return list(kept.items())
+
+
+def _get_declared_subscriptions(module):
+    """
+    Returns list of (topic, qos) tuples declared by the bot in SUBSCRIPTIONS.
+    Entries may be plain topic filters or (topic, qos) tuples.
+    """
+    subscriptions = getattr(module, "SUBSCRIPTIONS", None)
+    if subscriptions is None:
+        global_data["config"].logger.error(
+            f"{module.__file__} has on_message but no SUBSCRIPTIONS - not subscribing. "
+            "Declare SUBSCRIPTIONS = ['#'] to receive every message."
+        )
+        subscriptions = []
+    if isinstance(subscriptions, str):
+        subscriptions = [subscriptions]
+
+    result = []
+    for subscription in subscriptions:
+        if isinstance(subscription, str):
+            result.append((subscription, 0))
+        else:
+            topic, qos = subscription
+            result.append((topic, int(qos)))
+    return result
+
+
 def on_connect(client, userdata, flags, reason, properties):
-    global_data["config"].logger.debug(f"Client connected")
-    client.subscribe("#")
+    from .tools import get_module
+
+    config = global_data["config"]
+    config.logger.debug(f"Client connected")
+    metrics.inc("sre_mqtt_connects_total", client=config.bot.stem if config.bot else "")
+    spool = get_spool(client)
+    if spool:
+        spool.start_drain(client)
+    if not config.bot:
+        return
+    subscriptions = _get_subscriptions(get_module(config.bot))
+    if not subscriptions:
+        config.logger.debug(f"{config.bot} has no message handlers - not subscribing")
+        return
+    config.logger.info(
+        f"Subscribing to {', '.join(topic for topic, qos in subscriptions)}"
+    )
+    client.subscribe(subscriptions)
+
+
+def on_disconnect(client, userdata, reason, properties=None):
+    config = global_data["config"]
+    config.logger.warning(f"Disconnected from broker: {reason}")
+    metrics.inc("sre_mqtt_disconnects_total", client=config.bot.stem if config.bot else "")
 
 
 def on_message(client, userdata, msg):
     config = global_data["config"]
-    config.logger.debug(f"on_message: {msg.topic} {str(msg.payload)}")
-    from .tools import load_module
+    config.logger.debug("on_message: %s %s bytes", msg.topic, len(msg.payload))
+    from .tools import get_module
+    from .dispatcher import get_dispatcher
 
     if not config.bot:
         return
-    module = load_module(config.bot)
-    if getattr(module, "on_message", None):
+    get_dispatcher().submit(
+        msg.topic, _handle_message, client, get_module(config.bot), msg
+    )
+
+
+def _handle_message(client, module, msg):
+    """
+    Calls the bot's handlers matching the topic; returns False if one failed.
+    Nothing is decoded if no handler matches; with LAZY_PAYLOAD only if a
+    handler accesses the payload.
+    """
+    config = global_data["config"]
+    handlers = _get_router(module).match(msg.topic)
+    if not handlers:
+        return True
+    ok = True
+    client2 = _get_mqtt_wrapper(client, module)
+    value = Payload(msg.payload)
+    if not getattr(module, "LAZY_PAYLOAD", False):
+        value = value.decode()
+    bot = client2.modulename
+    metrics.inc("sre_messages_received_total", bot=bot)
+    started = time.perf_counter()
+    for handler in handlers:
         try:
-            client2 = _get_mqtt_wrapper(client, module)
-            try:
-                value = json.loads(msg.payload)
-            except Exception:
-                # default values
-                value = {
-                    "value": msg.payload,
-                    "timestamp": str(arrow.get().to("utc")),
-                    "module": None,
-                }
-            module.on_message(client2, msg, value)
+            if inspect.iscoroutinefunction(handler):
+                from .aio import AsyncClient, submit
 
+                # not awaited; the dispatcher thread continues with the next message
+                submit(handler(AsyncClient(client2), msg, value), f"{bot}:{handler.__name__}")
+            else:
+                handler(client2, msg, value)
         except Exception as ex:
             trace = traceback.format_exc()
             config.logger.error(str(ex) + "\n\n" + str(msg) + "\n\n" + trace)
+            ok = False
+    metrics.observe(
+        "sre_on_message_duration_seconds", time.perf_counter() - started, bot=bot
+    )
+    return ok
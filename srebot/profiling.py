@@ -0,0 +1,101 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+import traceback
+import click
+import paho.mqtt.client as mqtt
+
+
+def _load_messages(messages, messages_file):
+    result = list(messages)
+    if messages_file:
+        with open(messages_file) as file:
+            for line in file:
+                if line.strip():
+                    data = json.loads(line)
+                    payload = data.get("payload", "")
+                    if not isinstance(payload, str):
+                        payload = json.dumps(payload)
+                    result.append((data["topic"], payload))
+    return result
+
+
+def _make_message(topic, payload):
+    msg = mqtt.MQTTMessage(topic=topic.encode())
+    msg.payload = payload if isinstance(payload, bytes) else payload.encode()
+    return msg
+
+
+def _print_timings(name, timings, errors):
+    if not timings:
+        return
+    click.secho(
+        f"{name}: {len(timings)} calls, {errors} errors, "
+        f"avg {sum(timings) / len(timings) * 1000:.3f}ms "
+        f"min {min(timings) * 1000:.3f}ms max {max(timings) * 1000:.3f}ms",
+        fg="green",
+    )
+
+
+def profile_bot(config, script, runs, messages, sort, limit, dump, memory):
+    from .bench import FakeClient
+    from .mqtt_tools import _get_mqtt_wrapper, _handle_message
+    from .tools import get_module
+    from .aio import call_run
+
+    module = get_module(script)
+    client = FakeClient()
+    profile = cProfile.Profile()
+    if memory:
+        tracemalloc.start(25)
+
+    timings, errors = [], 0
+    if getattr(module, "run", None):
+        wrapper = _get_mqtt_wrapper(client, module)
+        for i in range(runs):
+            started = time.perf_counter()
+            profile.enable()
+            try:
+                call_run(module, wrapper)
+            except Exception:
+                errors += 1
+                config.logger.error(traceback.format_exc())
+            finally:
+                profile.disable()
+            timings.append(time.perf_counter() - started)
+    _print_timings("run", timings, errors)
+
+    timings = []
+    if messages and not getattr(module, "on_message", None):
+        click.secho(f"{script} has no on_message - messages are ignored", fg="yellow")
+    elif messages:
+        for topic, payload in messages:
+            msg = _make_message(topic, payload)
+            started = time.perf_counter()
+            profile.enable()
+            _handle_message(client, module, msg)
+            profile.disable()
+            timings.append(time.perf_counter() - started)
+    _print_timings("on_message", timings, 0)
+    click.secho(f"published messages: {client.published}", fg="green")
+    if memory:
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, cProfile.__file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        tracemalloc.stop()
+
+    output = io.StringIO()
+    stats = pstats.Stats(profile, stream=output)
+    stats.sort_stats(sort).print_stats(limit)
+    click.echo(output.getvalue())
+    if dump:
+        profile.dump_stats(dump)
+        click.secho(f"Profile written to {dump}", fg="green")
+
+    if memory:
+        click.secho("Top allocations (timings include tracemalloc overhead):", fg="yellow")
+        for stat in snapshot.statistics("lineno")[:limit]:
+            click.echo(f"{stat.size / 1024:10.1f} KiB {stat.count:8} allocations  {stat.traceback}")
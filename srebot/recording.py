@@ -0,0 +1,127 @@
+import struct
+import threading
+import time
+from pathlib import Path
+import click
+import paho.mqtt.client as mqtt
+
+MAGIC = b"SRE-RECORDING-1\n"
+# timestamp, flags (qos | retain << 2), topic length, payload length
+RECORD_HEADER = struct.Struct("!dBHI")
+
+
+def _encode(timestamp, topic, payload, qos=0, retain=False):
+    topic = topic.encode()
+    return (
+        RECORD_HEADER.pack(timestamp, qos | (int(bool(retain)) << 2), len(topic), len(payload))
+        + topic
+        + payload
+    )
+
+
+def iter_records(path):
+    """
+    Yields (timestamp, topic, payload, qos, retain) of a recording.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a recording")
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, flags, topic_length, payload_length = RECORD_HEADER.unpack(header)
+            topic = file.read(topic_length).decode()
+            payload = file.read(payload_length)
+            if len(payload) < payload_length:
+                # truncated by a crash while recording
+                return
+            yield timestamp, topic, payload, flags & 3, bool(flags & 4)
+
+
+def record(config, path, topics, duration=None, count=None):
+    from .mqtt_tools import _get_regular_client, _connect_client
+
+    path = Path(path)
+    new_file = not path.exists() or not path.stat().st_size
+    file = open(path, "ab")
+    if new_file:
+        file.write(MAGIC)
+    data = {"count": 0}
+    done = threading.Event()
+
+    def on_connect(client, userdata, flags, reason, properties):
+        client.subscribe([(topic, 0) for topic in topics])
+        config.logger.info(f"Recording {', '.join(topics)} to {path}")
+
+    def on_message(client, userdata, msg):
+        file.write(_encode(time.time(), msg.topic, msg.payload, msg.qos, msg.retain))
+        data["count"] += 1
+        if count and data["count"] >= count:
+            done.set()
+
+    client = _get_regular_client("_record", path)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    _connect_client(client)
+    client.loop_start()
+    started = time.monotonic()
+    try:
+        while not done.wait(1):
+            file.flush()
+            if duration and time.monotonic() - started > duration:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.disconnect()
+        client.loop_stop()
+        file.close()
+    click.secho(f"Recorded {data['count']} messages to {path}", fg="green")
+
+
+def replay(config, script, path, speed):
+    """
+    Streams a recording into on_message of a bot: with the original timing
+    divided by speed, or as fast as possible for speed 0.
+    """
+    from .bench import FakeClient, _percentile
+    from .mqtt_tools import _get_subscriptions, _handle_message, _strip_share
+    from .tools import get_module
+
+    module = get_module(script)
+    # WORKER_GROUP bots subscribe to '$share/<group>/<filter>'
+    subscriptions = [_strip_share(topic) for topic, qos in _get_subscriptions(module)]
+    if not subscriptions:
+        click.secho(f"{script} subscribes to nothing", fg="red")
+        return
+    client = FakeClient()
+    replayed, skipped, errors, latencies = 0, 0, 0, []
+    first, started = None, time.monotonic()
+
+    for timestamp, topic, payload, qos, retain in iter_records(path):
+        if not any(mqtt.topic_matches_sub(x, topic) for x in subscriptions):
+            skipped += 1
+            continue
+        if first is None:
+            first = timestamp
+        if speed:
+            delay = (timestamp - first) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        msg = mqtt.MQTTMessage(topic=topic.encode())
+        msg.payload, msg.qos, msg.retain = payload, qos, retain
+        t = time.perf_counter()
+        if not _handle_message(client, module, msg):
+            errors += 1
+        latencies.append(time.perf_counter() - t)
+        replayed += 1
+
+    duration = time.monotonic() - started
+    click.secho(
+        f"Replayed {replayed} messages ({skipped} not subscribed) in {duration:.2f}s: "
+        f"{replayed / duration if duration else 0:.1f} msg/s, {errors} errors, "
+        f"p50 {_percentile(latencies, 50) * 1000:.3f}ms p99 {_percentile(latencies, 99) * 1000:.3f}ms, "
+        f"{client.published} messages published",
+        fg="red" if errors else "green",
+    )
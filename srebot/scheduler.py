@@ -0,0 +1,174 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from datetime import datetime
+import croniter
+from . import global_data
+from . import metrics
+
+
+OVERRUN_POLICIES = ("skip", "coalesce", "concurrent")
+
+
+class Job(object):
+    """
+    overrun decides what happens if the job is due while a run is active:
+    skip the run, coalesce all missed runs into one that starts right after
+    the active run, or start concurrent runs up to max_concurrent.
+    """
+
+    def __init__(self, name, cron, callback, overrun="skip", max_concurrent=1, on_overrun=None):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f"overrun must be one of {', '.join(OVERRUN_POLICIES)}")
+        self.name = name
+        self.cron = cron
+        self.callback = callback
+        self.overrun = overrun
+        self.max_concurrent = max(1, int(max_concurrent)) if overrun == "concurrent" else 1
+        self.on_overrun = on_overrun
+        self.iter = croniter.croniter(cron, datetime.now().astimezone())
+        self.lock = threading.Lock()
+        self.deadline = None
+        self.cancelled = False
+        self.active = 0
+        self.pending = None
+        self.runs = 0
+        self.skipped = 0
+        self.overruns = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    @property
+    def running(self):
+        return self.active > 0
+
+    def schedule_next(self, now):
+        # do not catch up missed runs; continue with the next time after now
+        deadline = self.iter.get_next(float)
+        while deadline <= now:
+            deadline = self.iter.get_next(float)
+        self.deadline = deadline
+        return deadline
+
+    def _execute(self, deadline):
+        logger = global_data["config"].logger
+        while True:
+            self.lag = time.time() - deadline
+            self.max_lag = max(self.max_lag, self.lag)
+            metrics.observe("sre_scheduler_lag_seconds", max(self.lag, 0), job=self.name)
+            if self.lag > 1:
+                logger.warning(f"{self.name}: started {self.lag:.3f}s late")
+            else:
+                logger.debug("%s: scheduling lag %.1fms", self.name, self.lag * 1000)
+            try:
+                self.callback()
+            except Exception:
+                logger.error(traceback.format_exc())
+            with self.lock:
+                self.runs += 1
+                if self.pending is None or self.cancelled:
+                    self.pending = None
+                    self.active -= 1
+                    return
+                # coalesced catch-up run
+                deadline, self.pending = self.pending, None
+
+
+class Scheduler(object):
+    """
+    One thread per process that keeps the next fire times of all jobs in a
+    heap and sleeps until the earliest deadline. Jobs are executed in their
+    own worker thread; runs that are due while the previous one is still
+    active are handled by the job's overrun policy.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        self.thread = None
+
+    def add(self, name, cron, callback, **kwargs):
+        job = Job(name, cron, callback, **kwargs)
+        with self.condition:
+            self._push(job, time.time())
+            self.condition.notify()
+        self._ensure_started()
+        return job
+
+    def cancel(self, job):
+        # removed from the heap lazily when it is due
+        job.cancelled = True
+
+    def _push(self, job, now):
+        heapq.heappush(self.heap, (job.schedule_next(now), next(self.counter), job))
+
+    def _ensure_started(self):
+        if self.thread:
+            return
+        self.thread = threading.Thread(target=self._loop, name="scheduler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _loop(self):
+        with self.condition:
+            while True:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                deadline, _, job = self.heap[0]
+                if job.cancelled:
+                    heapq.heappop(self.heap)
+                    continue
+                delay = deadline - time.time()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                self._fire(job, deadline)
+                self._push(job, time.time())
+
+    def _fire(self, job, deadline):
+        with job.lock:
+            overrun = job.active >= job.max_concurrent
+            if not overrun:
+                job.active += 1
+            elif job.overrun == "coalesce" and job.pending is None:
+                job.overruns += 1
+                job.pending = deadline
+                action = "running once afterwards"
+            else:
+                job.overruns += 1
+                job.skipped += 1
+                action = "skipping run"
+        if overrun:
+            global_data["config"].logger.warning(
+                f"{job.name}: previous run still active - {action}"
+            )
+            metrics.inc("sre_run_overruns_total", job=job.name)
+            if job.on_overrun:
+                # may reload the bot and publish; must not hold up the scheduler
+                t = threading.Thread(
+                    target=self._call_overrun, args=(job,), name=f"{job.name}-overrun"
+                )
+                t.daemon = True
+                t.start()
+            return
+        t = threading.Thread(target=job._execute, args=(deadline,), name=job.name)
+        t.daemon = True
+        t.start()
+
+    def _call_overrun(self, job):
+        try:
+            job.on_overrun(job)
+        except Exception:
+            global_data["config"].logger.error(traceback.format_exc())
+
+
+_scheduler = Scheduler()
+
+
+def get_scheduler():
+    return _scheduler
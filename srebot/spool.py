@@ -0,0 +1,171 @@
+import sqlite3
+import threading
+import time
+import weakref
+from pathlib import Path
+import paho.mqtt.client as mqtt
+from . import global_data
+
+EVICTION_POLICIES = ("drop-oldest", "drop-new")
+
+_spools = weakref.WeakKeyDictionary()
+
+
+class Spool(object):
+    """
+    Persistent queue for messages published while the broker is not
+    reachable (SQLite in WAL mode). Drained in batches after reconnect.
+    """
+
+    def __init__(
+        self, path, max_messages=100000, eviction="drop-oldest", batch_size=500, ack_timeout=30
+    ):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"eviction must be one of {', '.join(EVICTION_POLICIES)}")
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_messages = max_messages
+        self.eviction = eviction
+        self.batch_size = batch_size
+        self.ack_timeout = ack_timeout
+        self.lock = threading.Lock()
+        self.drain_lock = threading.Lock()
+        self.evicted = 0
+        self.db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT, payload BLOB, "
+            "qos INTEGER, retain INTEGER)"
+        )
+        self.count = self.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def put(self, topic, payload, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self.lock:
+            if self.count >= self.max_messages:
+                if not self.evicted:
+                    global_data["config"].logger.warning(
+                        f"Spool {self.path} full ({self.max_messages} messages) - {self.eviction}"
+                    )
+                self.evicted += 1
+                if self.eviction == "drop-new":
+                    return False
+                deleted = self.db.execute(
+                    "DELETE FROM messages WHERE id IN "
+                    "(SELECT id FROM messages ORDER BY id LIMIT ?)",
+                    (self.count - self.max_messages + 1,),
+                ).rowcount
+                self.count -= deleted
+            self.db.execute(
+                "INSERT INTO messages (topic, payload, qos, retain) VALUES (?, ?, ?, ?)",
+                (topic, payload, qos, int(bool(retain))),
+            )
+            self.count += 1
+        return True
+
+    def _publish_batch(self, client, rows):
+        """
+        Publishes rows and returns the ids the broker acknowledged (qos 0:
+        written to the socket); waits at most ack_timeout seconds.
+        """
+        from .mqtt_tools import get_tracker
+
+        tracker = get_tracker(client)
+        lock = threading.Lock()
+        event = threading.Event()
+        acknowledged = []
+        expected = None
+
+        def done(id):
+            with lock:
+                acknowledged.append(id)
+                if len(acknowledged) == expected:
+                    event.set()
+
+        published = 0
+        for id, topic, payload, qos, retain in rows:
+            info = client.publish(topic, payload, qos=qos, retain=bool(retain))
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                break
+            published += 1
+            tracker.track(info.mid, lambda id=id: done(id))
+        with lock:
+            expected = published
+            if len(acknowledged) == expected:
+                event.set()
+        deadline = time.monotonic() + self.ack_timeout
+        while not event.wait(0.5):
+            if not client.is_connected() or time.monotonic() > deadline:
+                break
+        with lock:
+            return list(acknowledged), len(acknowledged) == len(rows)
+
+    def drain(self, client):
+        """
+        Sends the spooled messages batch by batch; a batch is deleted only as
+        far as it was acknowledged, so at most one batch is held in memory by
+        paho and nothing is lost if the connection drops again (messages may
+        be sent twice then).
+        """
+        if not self.drain_lock.acquire(blocking=False):
+            return
+        sent_total = 0
+        try:
+            while client.is_connected():
+                with self.lock:
+                    rows = self.db.execute(
+                        "SELECT id, topic, payload, qos, retain FROM messages ORDER BY id LIMIT ?",
+                        (self.batch_size,),
+                    ).fetchall()
+                if not rows:
+                    break
+                acknowledged, complete = self._publish_batch(client, rows)
+                if acknowledged:
+                    sent_total += len(acknowledged)
+                    with self.lock:
+                        self.count -= self.db.executemany(
+                            "DELETE FROM messages WHERE id = ?", [(x,) for x in acknowledged]
+                        ).rowcount
+                if not complete:
+                    break
+        finally:
+            self.drain_lock.release()
+        if sent_total:
+            global_data["config"].logger.info(
+                f"Sent {sent_total} spooled messages ({self.evicted} evicted, {self.count} left)"
+            )
+            self.evicted = 0
+
+    def start_drain(self, client):
+        t = threading.Thread(target=self.drain, args=(client,), name="spool-drain")
+        t.daemon = True
+        t.start()
+
+
+def open_spool(config, client, name):
+    """
+    Attaches a spool to the client if 'spool' is configured.
+    """
+    settings = config.config.get("spool")
+    if not settings:
+        return None
+    spool = Spool(
+        Path(settings.get("dir", "/var/lib/sre/spool")) / f"{name}.db",
+        max_messages=int(settings.get("max_messages", 100000)),
+        eviction=settings.get("eviction", "drop-oldest"),
+        batch_size=int(settings.get("batch_size", 500)),
+        ack_timeout=float(settings.get("ack_timeout", 30)),
+    )
+    _spools[client] = spool
+    return spool
+
+
+def get_spool(client):
+    try:
+        return _spools.get(client)
+    except TypeError:
+        return None
@@ -0,0 +1,242 @@
+import fcntl
+import hashlib
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from . import metrics
+from .tools import _get_md5
+
+
+def _proc_start_time(pid):
+    """
+    Start time of pid in clock ticks since boot; distinguishes a reused pid.
+    """
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return None
+    return stat.rsplit(")", 1)[1].split()[19]
+
+
+class Supervised(object):
+    def __init__(self, path):
+        self.path = path
+        self.process = None
+        self.md5 = None
+        self.started = None
+        self.stop_deadline = None
+        self.restart = False
+        self.removed = False
+        self.failures = 0
+        self.crashes = []
+        self.crash_loop = False
+        self.next_start = None
+
+
+class Supervisor(object):
+    """
+    Starts and watches the bot processes of the daemon. Nothing blocks: exits
+    are noticed on SIGCHLD (or the zygote's exit report) via a wakeup pipe,
+    stopping sends SIGTERM and escalates to SIGKILL in a later tick, crashed
+    bots are restarted with exponential backoff.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        settings = config.config.get("supervisor", {})
+        self.stop_timeout = float(settings.get("stop_timeout", 5))
+        self.backoff_initial = float(settings.get("backoff_initial", 1))
+        self.backoff_max = float(settings.get("backoff_max", 300))
+        self.stable_after = float(settings.get("stable_after", 60))
+        self.crash_loop_count = int(settings.get("crash_loop_count", 5))
+        self.crash_loop_window = float(settings.get("crash_loop_window", 300))
+        self.run_dir = Path(
+            config.config.get("run_dir")
+            or Path(tempfile.gettempdir()) / f"sre-run-{config.config['name']}"
+        )
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self.pid = os.getpid()
+        self.procs = {}
+
+        self.wakeup_fd, self._wakeup_write = os.pipe()
+        for fd in (self.wakeup_fd, self._wakeup_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: self.wake())
+        if config.zygote:
+            config.zygote.on_exit = self.wake
+
+    def wake(self):
+        try:
+            os.write(self._wakeup_write, b"x")
+        except BlockingIOError:
+            pass
+
+    def __contains__(self, path):
+        return path in self.procs
+
+    def get_md5(self, path):
+        return self.procs[path].md5
+
+    def _pidfile(self, path):
+        return self.run_dir / f"{path.stem}-{hashlib.md5(str(path).encode()).hexdigest()[:12]}.pid"
+
+    def _kill_stale(self, path):
+        # a bot left over by a previous daemon, e.g. after it was killed
+        pidfile = self._pidfile(path)
+        try:
+            pid, start_time = pidfile.read_text().split()
+            pid = int(pid)
+        except (OSError, ValueError):
+            return
+        if _proc_start_time(pid) == start_time:
+            self.config.logger.warning(f"Killing stale process {pid} of {path}")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        pidfile.unlink()
+
+    def _spawn(self, path):
+        config = self.config
+        if config.zygote:
+            try:
+                return config.zygote.spawn(path)
+            except Exception as ex:
+                config.logger.error(f"{ex} - starting new interpreter")
+        return subprocess.Popen([
+            sys.executable,
+            sys.argv[0],
+            '-c', config.config_file,
+            '-l', config.config.get('log_level'),
+            'run',
+            path,
+        ])
+
+    def start(self, path):
+        path = path.absolute()
+        proc = self.procs.setdefault(path, Supervised(path))
+        self.config.logger.info(f"Starting {path}...")
+        self._kill_stale(path)
+        proc.md5 = _get_md5(path)
+        proc.process = self._spawn(path)
+        proc.started = time.monotonic()
+        proc.next_start = None
+        self._pidfile(path).write_text(
+            f"{proc.process.pid} {_proc_start_time(proc.process.pid)}"
+        )
+
+    def stop(self, path, restart=False):
+        proc = self.procs[path]
+        proc.restart = restart
+        if proc.process and proc.process.poll() is None:
+            if proc.stop_deadline is None:
+                proc.stop_deadline = time.monotonic() + self.stop_timeout
+                proc.process.terminate()
+            return
+        # not running (e.g. waiting for a backoff restart)
+        proc.next_start = None
+        self._stopped(proc)
+
+    def restart(self, path):
+        proc = self.procs[path]
+        # the file was changed; give the new version a fresh start
+        proc.failures, proc.crashes, proc.crash_loop = 0, [], False
+        self.stop(path, restart=True)
+
+    def remove(self, path):
+        self.procs[path].removed = True
+        self.stop(path)
+
+    def tick(self):
+        try:
+            while os.read(self.wakeup_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        now = time.monotonic()
+        for proc in list(self.procs.values()):
+            if proc.process:
+                if proc.process.poll() is not None:
+                    self._exited(proc)
+                elif proc.stop_deadline and now > proc.stop_deadline:
+                    self.config.logger.warning(
+                        f"{proc.path} did not stop within {self.stop_timeout}s - killing"
+                    )
+                    proc.process.kill()
+                    proc.stop_deadline = now + self.stop_timeout
+                elif proc.failures and now - proc.started > self.stable_after:
+                    proc.failures, proc.crash_loop = 0, False
+            elif proc.next_start and now >= proc.next_start:
+                self.start(proc.path)
+
+    def timeout(self, maximum):
+        """
+        Seconds until the next restart or kill is due.
+        """
+        now = time.monotonic()
+        deadlines = [
+            x
+            for proc in self.procs.values()
+            for x in (proc.next_start, proc.stop_deadline)
+            if x is not None
+        ]
+        return max(0, min([maximum] + [x - now for x in deadlines]))
+
+    def _exited(self, proc):
+        rc = proc.process.poll()
+        self._pidfile(proc.path).unlink(missing_ok=True)
+        proc.process = None
+        if proc.stop_deadline is not None or proc.restart or proc.removed:
+            proc.stop_deadline = None
+            self._stopped(proc)
+        else:
+            self._crashed(proc, rc)
+
+    def _stopped(self, proc):
+        if proc.removed:
+            del self.procs[proc.path]
+        elif proc.restart:
+            proc.restart = False
+            self.start(proc.path)
+
+    def _crashed(self, proc, rc):
+        now = time.monotonic()
+        logger = self.config.logger
+        metrics.inc("sre_bot_crashes_total", bot=proc.path.stem)
+        if now - proc.started > self.stable_after:
+            proc.failures = 0
+        proc.failures += 1
+        delay = min(self.backoff_max, self.backoff_initial * 2 ** (proc.failures - 1))
+        proc.crashes = [x for x in proc.crashes if now - x < self.crash_loop_window] + [now]
+        if len(proc.crashes) >= self.crash_loop_count and not proc.crash_loop:
+            proc.crash_loop = True
+            metrics.inc("sre_bot_crash_loops_total", bot=proc.path.stem)
+            logger.error(
+                f"{proc.path} is crash looping: {len(proc.crashes)} crashes "
+                f"within {self.crash_loop_window:.0f}s"
+            )
+        logger.warning(f"{proc.path} exited with {rc} - restarting in {delay:.1f}s")
+        proc.next_start = now + delay
+
+    def shutdown(self, timeout=None):
+        """
+        Stops all bots at exit; waits at most stop_timeout before SIGKILL.
+        """
+        if os.getpid() != self.pid:
+            return
+        timeout = self.stop_timeout if timeout is None else timeout
+        running = [x.process for x in self.procs.values() if x.process]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and any(x.poll() is None for x in running):
+            time.sleep(0.05)
+        for process in running:
+            if process.poll() is None:
+                process.kill()
+        for proc in self.procs.values():
+            self._pidfile(proc.path).unlink(missing_ok=True)
@@ -1,18 +1,22 @@
 import os
-import arrow
 import hashlib
 import time
-import inquirer
 import click
 import sys
 import subprocess
+import threading
 from pathlib import Path
 from collections import namedtuple
 from importlib import import_module
 from contextlib import contextmanager
 import importlib.util
 
-PROC = namedtuple("Process", field_names=("process", "path", "md5"))
+CACHED_MODULE = namedtuple(
+    "CachedModule", field_names=("module", "stat", "md5", "reloads")
+)
+
+_module_cache = {}
+_module_cache_lock = threading.Lock()
 
 
 def _get_md5(filepath):
@@ -28,47 +32,91 @@ def _raise_error(msg):
     sys.exit(-1)
 
 
-def _get_bots_paths(config):
-    bots_paths = []
+IGNORED_DIRS = (".git", ".venv", "venv", "__pycache__", "node_modules", ".tox")
 
-    for path in config.config.get("bots-paths", []):
-        if not path:
-            continue
-        path = Path(path)
-        for path in path.glob("**/*.py"):
-            if ".git" in path.parts:
-                continue
-            if path.name.startswith("__"):
+
+def _is_ignored_dir(directory):
+    return directory.name in IGNORED_DIRS or (directory / "pyvenv.cfg").exists()
+
+
+def _is_ignored(path, roots):
+    """
+    True if path is outside of roots or below a directory _walk prunes.
+    """
+    for root in roots:
+        if root in path.parents:
+            return any(_is_ignored_dir(x) for x in path.parents if root in x.parents)
+    return True
+
+
+def _walk(root):
+    """
+    Yields (directory, python files) below root; ignored directories and
+    virtualenvs are pruned during the walk instead of filtered afterwards.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [x for x in dirnames if not _is_ignored_dir(Path(dirpath) / x)]
+        yield Path(dirpath), [Path(dirpath) / x for x in filenames if x.endswith(".py")]
+
+
+def _is_script(path):
+    return path.name.endswith(".py") and not path.name.startswith("__")
+
+
+class ScriptIndex(object):
+    """
+    Bot scripts below the configured bots-paths; built once by walking the
+    trees and then updated per changed file.
+    """
+
+    def __init__(self, roots):
+        self.roots = [Path(x) for x in roots if x]
+        self.dirs = {}
+        for root in self.roots:
+            for directory, files in _walk(root):
+                self._set_dir(directory, files)
+
+    def _set_dir(self, directory, files):
+        scripts = set(filter(_is_script, files))
+        if scripts:
+            self.dirs[directory] = scripts
+            if directory not in sys.path:
+                sys.path += [directory]
+        else:
+            self.dirs.pop(directory, None)
+
+    def update(self, paths):
+        for directory in set(Path(x).parent for x in paths):
+            if _is_ignored(directory / "_", self.roots):
+                self.dirs.pop(directory, None)
                 continue
-            if path.name.endswith(".py"):
-                bots_paths.append(path.parent)
+            try:
+                files = [directory / x for x in os.listdir(directory)]
+            except (FileNotFoundError, NotADirectoryError):
+                files = []
+            self._set_dir(directory, [x for x in files if x.is_file()])
 
-    for path in bots_paths:
-        if path not in sys.path:
-            sys.path += [path]
-    return bots_paths
+    def scripts(self):
+        return sorted(x for scripts in self.dirs.values() for x in scripts)
 
 
-def iterate_scripts(config):
-    result = set()
+def _get_script_index(config):
+    if config.script_index is None:
+        config.script_index = ScriptIndex(config.config.get("bots-paths", []))
+    return config.script_index
 
-    def _collect():
-        for bots_path in _get_bots_paths(config):
-            for script in bots_path.glob("*.py"):
-                if script.name.startswith("__"):
-                    continue
-                yield script
 
-    for x in _collect():
-        result.add(x)
-    return sorted(list(result))
+def iterate_scripts(config):
+    return _get_script_index(config).scripts()
 
 
 def _get_robot_file(config, name):
     if name and name.startswith("/") or name.startswith("./"):
         name = Path(name).absolute()
     if not name:
-        scripts = list(sorted(set(iterate_scripts(config))))
+        import inquirer
+
+        scripts = iterate_scripts(config)
         questions = [inquirer.List("file", choices=scripts)]
         answer = inquirer.prompt(questions)
         if not answer["file"]:
@@ -85,37 +133,16 @@ def _get_robot_file(config, name):
     return filtered[0].absolute()
 
 
-def kill_proc(proc, timeout):
+def cleanup():
     from . import global_data
 
-    if not global_data["config"]:
-        return
-    p_sec = 0
-    for second in range(timeout):
-        if proc.process.poll() is None:
-            time.sleep(0.1)
-            p_sec += 1
-    if p_sec >= timeout:
-        proc.process.kill()  # supported from python 2.6
     config = global_data["config"]
-    config.processes.pop(config.processes.index(proc))
-
-
-def kill_all_processes():
-    from . import global_data
-
-    timeout_sec = 1
-    if not global_data["config"]:
-        return
-    for p in global_data["config"].processes:
-        kill_proc(p, timeout_sec)
-
-
-def cleanup():
-    kill_all_processes()
+    if config and config.supervisor:
+        config.supervisor.shutdown()
 
 
 def _select_bot_path():
+    import inquirer
     from . import global_data
 
     config = global_data["config"]
@@ -143,6 +170,58 @@ def load_module(path):
     return foo
 
 
+def _get_stat(path):
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_module(path):
+    """
+    Returns the loaded bot module from cache. The script is only executed
+    again, if mtime/size changed and the content hash differs.
+    """
+    from . import global_data
+
+    path = Path(path)
+    stat = _get_stat(path)
+    cached = _module_cache.get(path)
+    if cached and (cached.stat == stat or stat is None):
+        return cached.module
+
+    with _module_cache_lock:
+        cached = _module_cache.get(path)
+        if cached and cached.stat == stat:
+            return cached.module
+        md5 = _get_md5(path)
+        if cached and cached.md5 == md5:
+            # touched but not changed
+            _module_cache[path] = cached._replace(stat=stat)
+            return cached.module
+
+        try:
+            module = load_module(path)
+        except Exception:
+            if not cached:
+                raise
+            global_data["config"].logger.error(
+                f"Reloading {path} failed - keeping previous version"
+            )
+            _module_cache[path] = cached._replace(stat=stat, md5=md5)
+            return cached.module
+
+        reloads = cached.reloads + 1 if cached else 0
+        _module_cache[path] = CACHED_MODULE(
+            module=module, stat=stat, md5=md5, reloads=reloads
+        )
+
+    if cached:
+        global_data["config"].logger.info(f"Reloaded {path} (reload #{reloads})")
+    return module
+
+
 @contextmanager
 def _onetime_client(name_appendix, script, timeout=10):
     from .mqtt_tools import _get_regular_client
@@ -157,7 +236,7 @@ def _onetime_client(name_appendix, script, timeout=10):
     client.on_publish = on_publish
     _connect_client(client)
     yield client
-    timeout = arrow.get().shift(seconds=timeout)
-    while not data["stop"] and arrow.get() < timeout:
+    deadline = time.monotonic() + timeout
+    while not data["stop"] and time.monotonic() < deadline:
         client.loop(0.1)
     client.disconnect()
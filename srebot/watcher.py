@@ -0,0 +1,188 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from .tools import _walk, _is_ignored
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _get_stat(path):
+    try:
+        stat = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class PollingWatcher(object):
+    """
+    Rescans the bot directories every interval and reports python files whose
+    mtime/size changed, appeared or disappeared.
+    """
+
+    def __init__(self, roots, interval=2):
+        self.roots = [Path(x) for x in roots if x]
+        self.interval = interval
+        self.stats = {}
+        self.changed(self._scan())
+
+    def _scan(self):
+        result = set()
+        for root in self.roots:
+            for _, files in _walk(root):
+                result |= set(files)
+        return result | set(self.stats)
+
+    def changed(self, candidates):
+        result = set()
+        for path in candidates:
+            stat = _get_stat(path)
+            if stat == self.stats.get(path):
+                continue
+            if stat is None:
+                self.stats.pop(path, None)
+            else:
+                self.stats[path] = stat
+            result.add(path)
+        return result
+
+    def wait(self, timeout=None, wakeup=None):
+        timeout = self.interval if timeout is None else min(timeout, self.interval)
+        if wakeup is None:
+            time.sleep(timeout)
+        else:
+            select.select([wakeup], [], [], timeout)
+        return self.changed(self._scan())
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(PollingWatcher):
+    """
+    Watches the bot directories with inotify. Events are collected until the
+    directories were quiet for `debounce` seconds, so an editor's save burst
+    results in one change.
+    """
+
+    def __init__(self, roots, debounce=0.3, max_delay=2):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.watches = {}
+        super().__init__(roots)
+
+    def _scan(self):
+        result = set()
+        for root in self.roots:
+            result |= self._watch_tree(root)
+        return result | set(self.stats)
+
+    def _watch_tree(self, root):
+        if root not in self.roots and _is_ignored(root / "_", self.roots):
+            return set()
+        files = set()
+        for directory, dir_files in _walk(root):
+            wd = self._add_watch(self.fd, str(directory).encode(), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = directory
+            files |= set(dir_files)
+        return files
+
+    def _read_events(self):
+        candidates = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return candidates
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # events lost - compare everything
+                return self._scan()
+            directory = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            if directory is None:
+                continue
+            path = directory / name if name else directory
+            if mask & IN_ISDIR:
+                if _is_ignored(path / "_", self.roots):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    candidates |= self._watch_tree(path)
+                else:
+                    candidates |= {x for x in self.stats if path in x.parents}
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                candidates |= {x for x in self.stats if directory in x.parents}
+            elif name.endswith(".py"):
+                candidates.add(path)
+        return candidates
+
+    def wait(self, timeout=None, wakeup=None):
+        """
+        Returns early with an empty set if the wakeup fd becomes readable.
+        """
+        fds = [self.fd] if wakeup is None else [self.fd, wakeup]
+        readable, _, _ = select.select(fds, [], [], timeout)
+        if self.fd not in readable:
+            return set()
+        candidates = self._read_events()
+        deadline = time.monotonic() + self.max_delay
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([self.fd], [], [], self.debounce)
+            if not readable:
+                break
+            candidates |= self._read_events()
+        return self.changed(candidates)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher(config):
+    roots = config.config.get("bots-paths", [])
+    if config.config.get("file_watcher", "inotify") == "inotify" and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(
+                roots, debounce=float(config.config.get("watch_debounce", 0.3))
+            )
+        except (OSError, AttributeError) as ex:
+            config.logger.warning(f"inotify not available, polling for changes: {ex}")
+    return PollingWatcher(roots)
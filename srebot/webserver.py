@@ -1,32 +1,147 @@
 import simplejson
 import http.server
 import json
+import threading
 from pathlib import Path
 import sys
 
-class Handler(http.server.SimpleHTTPRequestHandler) :
+
+class TriggerPublisher(object):
+    # Long lived connection used by all trigger requests; paho's network
+    # thread reconnects automatically.
+
+    def __init__(self, config):
+        from .mqtt_tools import _get_regular_client, PublishTracker
+
+        self.config = config
+        self.client = _get_regular_client("_webtrigger", Path(sys.argv[0]))
+        self.client.reconnect_delay_set(1, 30)
+        self.tracker = PublishTracker(self.client)
+        broker = config.config["broker"]
+        self.client.connect_async(broker["ip"], broker.get("port", 1883), 60)
+        self.client.loop_start()
+
+    def publish(self, topic, payload, qos=2, timeout=10, wait=True):
+        event = self.tracker.publish(topic, payload, qos=qos)
+        if not wait:
+            return True
+        if not event.wait(timeout):
+            self.config.logger.error(f"Trigger {topic} not acknowledged after {timeout}s")
+            return False
+        return True
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
     # A new Handler is created for every incommming request tho do_XYZ
     # methods correspond to different HTTP methods.
+    protocol_version = "HTTP/1.1"
 
-    def do_GET(self):
-        self.send_response(200)
+    def setup(self):
+        # closes idle keep-alive connections
+        self.timeout = self.server.settings["keepalive_timeout"]
+        super().setup()
+
+    def _respond(self, status):
+        self.send_response(status)
         self.send_header("Content-type", "text/html")
+        self.send_header("Content-Length", "0")
+        if self.close_connection:
+            self.send_header("Connection", "close")
         self.end_headers()
 
+    def _read_body(self):
+        """
+        Reads the request body so that the connection can be reused. Returns
+        None and closes the connection if the body cannot be consumed.
+        """
+        length = self.headers['Content-Length']
+        if length is None:
+            if self.headers['Transfer-Encoding']:
+                self.close_connection = True
+            return b""
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0 or length > self.server.settings["max_body"]:
+            self.close_connection = True
+            return None
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        self._read_body()
+        if self.path == "/metrics":
+            from . import metrics
+            from . import global_data
+            body = metrics.render(global_data['config']).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            if self.close_connection:
+                self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self._respond(200)
+
     def do_POST(self):
-        from .tools import _onetime_client
-        if self.path != "/":
-            self.data_string = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == "/":
+            self._read_body()
+            return self._respond(200)
+
+        if self.headers['Content-Length'] is None:
+            self.close_connection = True
+            return self._respond(411)
+        self.data_string = self._read_body()
+        if self.data_string is None:
+            return self._respond(413)
+        try:
             data = simplejson.loads(self.data_string)
+        except ValueError:
+            return self._respond(400)
 
-            if self.path.startswith("/trigger/"):
-                with _onetime_client("_webtrigger", Path(sys.argv[0])) as client:
-                    data = json.dumps(data).encode('utf-8')
-                    client.publish(self.path[1:], data, 2)
+        status = 200
+        if self.path.startswith("/trigger/"):
+            data = json.dumps(data).encode('utf-8')
+            wait = self.server.settings["wait_for_ack"]
+            if not self.server.publisher.publish(self.path[1:], data, 2, wait=wait):
+                status = 504
+            elif not wait:
+                status = 202
+        self._respond(status)
+
+
+class TriggerServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, settings):
+        self.settings = settings
+        self.slots = threading.BoundedSemaphore(settings["max_connections"])
+        super().__init__(address, handler)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            try:
+                request.sendall(
+                    b"HTTP/1.1 503 Service Unavailable\r\n"
+                    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
 
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
-        self.end_headers()
 
 def start_webserver():
     from . import global_data
@@ -35,7 +150,14 @@ def start_webserver():
         global_data['config'].logger.info("No webserver configured - triggering on this host not possible.")
         return
 
-    http_server = http.server.HTTPServer(
+    settings = {
+        "max_connections": int(config.get("http_max_connections", 32)),
+        "max_body": int(config.get("http_max_body", 1024 * 1024)),
+        "keepalive_timeout": float(config.get("http_keepalive_timeout", 30)),
+        "wait_for_ack": bool(config.get("http_wait_for_ack", False)),
+    }
+    http_server = TriggerServer(
         (config['http_address'], int(config.get('http_port', 8822))
-    ), Handler)
+    ), Handler, settings)
+    http_server.publisher = TriggerPublisher(global_data['config'])
     http_server.serve_forever()
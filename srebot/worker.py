@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import time
+import traceback
+from . import global_data
+
+
+class RunTimeout(Exception):
+    pass
+
+
+class PipeClient(object):
+    """
+    Client passed to run() inside the worker process: the mqtt connection
+    belongs to the parent, so publishes are sent back through a pipe.
+    """
+
+    def __init__(self, conn, hostname, modulename):
+        self.conn = conn
+        self.hostname = hostname
+        self.modulename = modulename
+        self.logger = global_data["config"].logger
+
+    def publish(self, path, payload=None, qos=0, retain=False):
+        self.conn.send(("publish", path, payload, qos, retain))
+
+    def publish_many(self, items, qos=0, retain=False):
+        self.conn.send(("publish_many", list(items), qos, retain))
+
+
+def _work(module, conn, hostname, modulename):
+    try:
+        module.run(PipeClient(conn, hostname, modulename))
+    except BaseException as ex:
+        conn.send(("error", str(ex) or type(ex).__name__, traceback.format_exc()))
+    else:
+        conn.send(("done",))
+    finally:
+        from .log_tools import stop
+        conn.close()
+        stop()
+        os._exit(0)
+
+
+def run_in_worker(module, client, timeout):
+    """
+    Executes module.run in a forked process which is killed after timeout
+    seconds; publishes of the worker go through client.
+    """
+    context = multiprocessing.get_context("fork")
+    reader, writer = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_work,
+        args=(module, writer, client.hostname, client.modulename),
+        name=f"run-{client.modulename}",
+        daemon=True,
+    )
+    process.start()
+    writer.close()
+    deadline = time.monotonic() + timeout
+    error = None
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RunTimeout(f"run() of {client.modulename} timed out after {timeout}s")
+            if not reader.poll(remaining):
+                continue
+            try:
+                message = reader.recv()
+            except EOFError:
+                error = f"worker of {client.modulename} exited unexpectedly"
+                break
+            if message[0] == "publish":
+                client.publish(*message[1:])
+            elif message[0] == "publish_many":
+                client.publish_many(*message[1:])
+            else:
+                if message[0] == "error":
+                    global_data["config"].logger.error(message[2])
+                    error = message[1]
+                break
+    finally:
+        reader.close()
+        if time.monotonic() < deadline:
+            # finished; give it a moment to exit by itself
+            process.join(1)
+        if process.is_alive():
+            process.kill()
+        process.join()
+    if error:
+        raise Exception(error)
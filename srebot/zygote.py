@@ -0,0 +1,178 @@
+import gc
+import json
+import os
+import select
+import signal
+import socket
+import threading
+import traceback
+from pathlib import Path
+from . import global_data
+
+
+def _exitcode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _send(sock, data):
+    sock.sendall(json.dumps(data).encode() + b"\n")
+
+
+class ZygoteProcess(object):
+    """
+    Bot process forked by the zygote; offers the part of subprocess.Popen
+    used by the daemon.
+    """
+
+    def __init__(self, zygote, pid):
+        self.zygote = zygote
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            self.returncode = self.zygote.exits.pop(self.pid, None)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class Zygote(object):
+    """
+    Process forked from the daemon before any thread is started. It imports
+    the framework once and forks a child per bot, which then only loads the
+    bot script; read-only pages are shared between all bots.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.exits = {}
+        self.replies = {}
+        self.reply_event = threading.Condition()
+        self.counter = 0
+        self.on_exit = None
+        self.sock, child_sock = socket.socketpair()
+        self.pid = os.fork()
+        if not self.pid:
+            self.sock.close()
+            try:
+                _serve(config, child_sock)
+            except BaseException:
+                config.logger.error(traceback.format_exc())
+            finally:
+                from .log_tools import stop
+                stop()
+                os._exit(0)
+        child_sock.close()
+        t = threading.Thread(target=self._read, name="zygote")
+        t.daemon = True
+        t.start()
+
+    def _read(self):
+        buffer = b""
+        while True:
+            data = self.sock.recv(65536)
+            if not data:
+                self.config.logger.error("Zygote exited")
+                with self.reply_event:
+                    self.pid = None
+                    self.reply_event.notify_all()
+                return
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                message = json.loads(line)
+                if "exit" in message:
+                    self.exits[message["exit"]] = message["rc"]
+                    if self.on_exit:
+                        self.on_exit()
+                else:
+                    with self.reply_event:
+                        self.replies[message["id"]] = message["pid"]
+                        self.reply_event.notify_all()
+
+    def spawn(self, path, timeout=10):
+        with self.lock:
+            self.counter += 1
+            id = self.counter
+            _send(self.sock, {"id": id, "path": str(path)})
+        with self.reply_event:
+            if not self.reply_event.wait_for(
+                lambda: id in self.replies or not self.pid, timeout
+            ) or not self.pid:
+                raise Exception(f"Zygote did not spawn {path}")
+            pid = self.replies.pop(id)
+        return ZygoteProcess(self, pid)
+
+
+def _serve(config, sock):
+    # everything a bot needs is imported here once and shared by the forks
+    from . import bot, mqtt_tools, scheduler, dispatcher, metrics, spool, tools  # noqa: F401
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # keep the garbage collector from touching (and copying) shared pages
+    gc.freeze()
+    children = set()
+    buffer = b""
+    while True:
+        readable, _, _ = select.select([sock], [], [], 0.5)
+        if readable:
+            data = sock.recv(65536)
+            if not data:
+                # daemon is gone
+                for pid in children:
+                    try:
+                        os.kill(pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+                return
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                message = json.loads(line)
+                pid = os.fork()
+                if not pid:
+                    _run_child(config, sock, Path(message["path"]))
+                children.add(pid)
+                _send(sock, {"id": message["id"], "pid": pid})
+
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                break
+            children.discard(pid)
+            _send(sock, {"exit": pid, "rc": _exitcode(status)})
+
+
+def _run_child(config, sock, path):
+    from .bot import run_bot
+
+    rc = 0
+    try:
+        sock.close()
+        global_data["config"] = config
+        run_bot(config, path)
+    except BaseException:
+        config.logger.error(traceback.format_exc())
+        rc = 1
+    finally:
+        from .log_tools import stop
+        stop()
+        os._exit(rc)
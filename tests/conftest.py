@@ -0,0 +1,24 @@
+import json
+import pytest
+from srebot import global_data
+from srebot.config import Config
+
+
+@pytest.fixture
+def config(tmp_path):
+    """
+    Config on a temporary sre.conf, registered in global_data like the cli
+    does.
+    """
+    config_file = tmp_path / "sre.conf"
+    config_file.write_text(json.dumps({
+        "bots-paths": [str(tmp_path / "bots")],
+        "name": "test",
+        "log_level": "info",
+        "broker": {"ip": "127.0.0.1"},
+    }))
+    (tmp_path / "bots").mkdir()
+    previous = global_data["config"]
+    global_data["config"] = config = Config(config_file)
+    yield config
+    global_data["config"] = previous
@@ -0,0 +1,18 @@
+from click.testing import CliRunner
+from srebot import bot, cli
+
+ASYNC_BOT = """
+import asyncio
+
+async def run(client):
+    await asyncio.sleep(0)
+    await client.publish("state", "on", qos=1)
+    await client.publish_many([("a", 1), ("b", 2, 1, True)], qos=1)
+"""
+
+
+def test_test_bot_runs_async_bot(config, tmp_path):
+    (tmp_path / "bots" / "async_bot.py").write_text(ASYNC_BOT)
+    result = CliRunner().invoke(cli, [bot.test_bot.name, "async_bot"], obj=config)
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ["state:1: on", "a:1: 1", "b:1: 2"]
@@ -0,0 +1,38 @@
+"""
+The 'sre bench' scenarios with small counts: they must run and report
+sane throughput and latencies.
+"""
+import pytest
+from srebot.bench import bench_daemon, bench_on_message, bench_publish, bench_scheduler
+
+
+def _check(result, count, max_p99=1.0):
+    assert result["count"] == count
+    assert result["throughput"] > 0
+    assert 0 <= result["p50"] <= result["p99"] < max_p99
+
+
+def test_on_message(config, tmp_path):
+    result = bench_on_message(config, count=500, workdir=tmp_path)
+    _check(result, 500)
+    assert result["throughput"] > 500
+
+
+@pytest.mark.parametrize("count", [1, 1000])
+def test_publish(config, count):
+    publish, publish_many = bench_publish(config, count=count)
+    _check(publish, count, max_p99=0.1)
+    _check(publish_many, count)
+    assert publish["throughput"] > 1000
+
+
+def test_daemon(config, tmp_path):
+    build, tick = bench_daemon(config, scripts=50, ticks=10, workdir=tmp_path)
+    _check(build, 1)
+    _check(tick, 10, max_p99=0.5)
+
+
+def test_scheduler(config):
+    result = bench_scheduler(config, jobs=5, duration=1.5)
+    assert result["count"] >= 5
+    assert result["p99"] < 0.5
@@ -0,0 +1,42 @@
+import itertools
+from srebot.bench import FakeClient
+from srebot.mqtt_tools import ChangeFilter, mqttwrapper
+
+
+def test_change_filter_deadband():
+    change_filter = ChangeFilter(deadband=0.5)
+    assert change_filter.changed("t", 10)
+    assert not change_filter.changed("t", 10.4)
+    assert change_filter.changed("t", 10.6)
+    assert not change_filter.changed("t", 10.2)
+    assert change_filter.changed("other", 10)
+    assert change_filter.suppressed == 2
+
+
+def test_change_filter_compares_objects_by_value():
+    change_filter = ChangeFilter()
+    value = {"state": "on"}
+    assert change_filter.changed("t", value)
+    assert not change_filter.changed("t", {"state": "on"})
+    value["state"] = "off"
+    assert change_filter.changed("t", value)
+
+
+def test_change_filter_max_silence():
+    change_filter = ChangeFilter(max_silence=0)
+    assert all(change_filter.changed("t", 1) for _ in range(3))
+
+
+def test_change_filter_topics():
+    change_filter = ChangeFilter(topics="sensor/#")
+    results = [change_filter.changed(topic, 1) for topic, _ in itertools.product(["sensor/a", "other"], range(2))]
+    assert results == [True, False, True, True]
+
+
+def test_wrapper_suppresses_unchanged(config):
+    client = FakeClient()
+    wrapper = mqttwrapper(client, "host", "bot", ChangeFilter())
+    assert wrapper.publish("state", 1) is not None
+    assert wrapper.publish("state", 1) is None
+    assert wrapper.publish("state", 2) is not None
+    assert client.published == 2
@@ -0,0 +1,62 @@
+import threading
+import time
+from srebot.dispatcher import Dispatcher
+
+
+def _join(dispatcher):
+    for q in dispatcher.queues:
+        q.join()
+
+
+def test_default_handles_one_message_at_a_time_in_order(config):
+    dispatcher = Dispatcher()
+    handled, active = [], []
+
+    def handler(i):
+        active.append(i)
+        assert len(active) == 1
+        time.sleep(0.001)
+        handled.append(i)
+        active.remove(i)
+
+    for i in range(50):
+        dispatcher.submit(f"t/{i % 3}", handler, i)
+    _join(dispatcher)
+    assert handled == list(range(50))
+
+
+def test_ordered_keeps_topic_order(config):
+    dispatcher = Dispatcher(workers=4)
+    handled = {}
+
+    def handler(topic, i):
+        time.sleep(0.0005 * (i % 3))
+        handled.setdefault(topic, []).append(i)
+
+    for i in range(100):
+        dispatcher.submit(f"t/{i % 5}", handler, f"t/{i % 5}", i)
+    _join(dispatcher)
+    assert all(x == sorted(x) for x in handled.values())
+
+
+def test_drop_oldest_reports_evicted(config):
+    dispatcher = Dispatcher(queue_size=2, overflow="drop-oldest")
+    release, handled = threading.Event(), []
+    dispatcher.submit("block", release.wait)
+    time.sleep(0.05)
+    assert all(dispatcher.submit(key, handled.append, key) for key in "abcd")
+    assert dispatcher.dropped == 2
+    release.set()
+    _join(dispatcher)
+    assert handled == ["c", "d"]
+
+
+def test_drop_new(config):
+    dispatcher = Dispatcher(queue_size=1, overflow="drop-new")
+    release, handled = threading.Event(), []
+    dispatcher.submit("block", release.wait)
+    time.sleep(0.05)
+    assert [dispatcher.submit(key, handled.append, key) for key in "ab"] == [True, False]
+    release.set()
+    _join(dispatcher)
+    assert handled == ["a"]
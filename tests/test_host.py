@@ -0,0 +1,39 @@
+from srebot.bench import FakeBroker, FakeClient
+from srebot.dispatcher import get_dispatcher
+from srebot.host import BotHost
+from srebot.tools import get_module
+
+BOT = """
+SUBSCRIPTIONS = [{filter!r}]
+GOT = []
+
+def on_message(client, msg, payload=None):
+    GOT.append(msg.topic)
+"""
+
+
+def test_each_bot_handles_a_message_once(config, tmp_path):
+    broker = FakeBroker()
+    host = BotHost(config)
+    host.client = FakeClient(broker)
+    host.client.on_message = host.on_message
+    paths = []
+    for name, topic_filter in [("a", "x/#"), ("b", "x/1"), ("c", "y/+")]:
+        path = tmp_path / "bots" / f"{name}.py"
+        path.write_text(BOT.format(filter=topic_filter))
+        assert host.add(path)
+        paths.append(path)
+    assert sorted(host.subscribed) == ["x/#", "y/+"]
+
+    publisher = FakeClient(broker)
+    for topic in ["x/0", "x/1", "x/2", "y/1"]:
+        publisher.publish(topic, "1")
+    for q in get_dispatcher().queues:
+        q.join()
+    a, b, c = [get_module(x) for x in paths]
+    assert sorted(a.GOT) == ["x/0", "x/1", "x/2"]
+    assert b.GOT == ["x/1"]
+    assert c.GOT == ["y/1"]
+
+    host.remove(paths[0])
+    assert sorted(host.subscribed) == ["x/1", "y/+"]
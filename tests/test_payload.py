@@ -0,0 +1,76 @@
+import json
+import paho.mqtt.client as mqtt
+import pytest
+from srebot.bench import FakeClient
+from srebot.mqtt_tools import Payload, _handle_message
+from srebot.tools import get_module
+
+
+def test_payload_is_decoded_lazily():
+    payload = Payload(json.dumps({"value": 5, "timestamp": "t", "module": "m"}).encode())
+    assert "not decoded" in repr(payload)
+    assert bytes(payload.raw) == payload._raw
+    assert "not decoded" in repr(payload)
+    assert payload.value == 5
+    assert payload["module"] == "m"
+    assert dict(payload) == {"value": 5, "timestamp": "t", "module": "m"}
+
+
+@pytest.mark.parametrize("raw, value", [
+    (b"12", 12),
+    (b'"on"', "on"),
+    (b"not json", b"not json"),
+])
+def test_payload_wraps_values_in_envelope(raw, value):
+    payload = Payload(raw, received=0)
+    assert payload.value == value
+    assert payload.module is None
+    assert payload.timestamp.startswith("1970-01-01T00:00:00")
+
+
+def test_payload_data_raises_for_invalid_json():
+    with pytest.raises(ValueError):
+        Payload(b"{").data
+
+
+@pytest.mark.parametrize("raw, value", [
+    (b"12", 12),
+    (b"[1, 2]", [1, 2]),
+    (b'{"value": 1}', {"value": 1}),
+])
+def test_decode_keeps_json_types(raw, value):
+    assert Payload(raw).decode() == value
+
+
+def test_decode_wraps_invalid_json():
+    decoded = Payload(b"not json").decode()
+    assert type(decoded) is dict
+    assert decoded["value"] == b"not json" and decoded["module"] is None
+
+
+BOT = """
+SUBSCRIPTIONS = ["#"]
+GOT = []
+
+def on_message(client, msg, payload=None):
+    GOT.append(payload)
+"""
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_handlers_get_payload(config, tmp_path, lazy):
+    script = tmp_path / "bots" / f"bot_{lazy}.py"
+    script.write_text(BOT + f"LAZY_PAYLOAD = {lazy}\n")
+    module = get_module(script)
+    for payload in [b"12", b'{"value": "on"}']:
+        msg = mqtt.MQTTMessage(topic=b"a/b")
+        msg.payload = payload
+        assert _handle_message(FakeClient(), module, msg)
+    number, obj = module.GOT
+    if lazy:
+        assert isinstance(number, Payload) and number.value == 12 and number.data == 12
+        assert obj.value == "on"
+    else:
+        assert number == 12
+        assert obj == {"value": "on"} and type(obj) is dict
+        json.dumps(obj)
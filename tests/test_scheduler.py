@@ -0,0 +1,91 @@
+import threading
+import time
+import pytest
+from srebot.scheduler import Job, Scheduler
+
+
+def _blocking_job(overrun, **kwargs):
+    release = threading.Event()
+    started = []
+
+    def callback():
+        started.append(time.time())
+        release.wait(5)
+
+    job = Job("test", "* * * * *", callback, overrun=overrun, **kwargs)
+    return job, started, release
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_invalid_overrun_policy():
+    with pytest.raises(ValueError):
+        Job("test", "* * * * *", lambda: None, overrun="queue")
+
+
+def test_overrun_skip(config):
+    job, started, release = _blocking_job("skip")
+    scheduler = Scheduler()
+    for _ in range(3):
+        scheduler._fire(job, time.time())
+    assert job.skipped == 2 and job.overruns == 2
+    release.set()
+    _wait_for(lambda: not job.running)
+    assert len(started) == 1 and job.runs == 1
+
+
+def test_overrun_coalesce(config):
+    overruns = []
+    job, started, release = _blocking_job("coalesce", on_overrun=overruns.append)
+    scheduler = Scheduler()
+    for _ in range(4):
+        scheduler._fire(job, time.time())
+    # the missed runs are replaced by a single one
+    assert job.overruns == 3 and job.skipped == 2
+    _wait_for(lambda: len(overruns) == 3)
+    release.set()
+    _wait_for(lambda: not job.running)
+    assert len(started) == 2 and job.runs == 2
+
+
+def test_on_overrun_does_not_block_scheduler(config):
+    release = threading.Event()
+    job, started, release_job = _blocking_job("skip", on_overrun=lambda job: release.wait(5))
+    scheduler = Scheduler()
+    scheduler._fire(job, time.time())
+    t = time.monotonic()
+    with scheduler.condition:
+        scheduler._fire(job, time.time())
+    assert time.monotonic() - t < 1
+    release.set()
+    release_job.set()
+
+
+def test_overrun_concurrent(config):
+    job, started, release = _blocking_job("concurrent", max_concurrent=2)
+    scheduler = Scheduler()
+    for _ in range(3):
+        scheduler._fire(job, time.time())
+    _wait_for(lambda: len(started) == 2)
+    assert job.active == 2 and job.skipped == 1
+    release.set()
+    _wait_for(lambda: not job.running)
+    assert job.runs == 2
+
+
+def test_scheduler_runs_and_cancels(config):
+    runs = []
+    scheduler = Scheduler()
+    # seconds are the last field
+    job = scheduler.add("every-second", "* * * * * *", lambda: runs.append(1))
+    _wait_for(lambda: runs, timeout=3)
+    scheduler.cancel(job)
+    time.sleep(0.1)
+    count = len(runs)
+    time.sleep(1.2)
+    assert len(runs) == count
@@ -0,0 +1,72 @@
+import pytest
+from srebot.bench import FakeClient
+from srebot.spool import Spool
+
+
+def _topics(spool):
+    return [x[0] for x in spool.db.execute("SELECT topic FROM messages ORDER BY id")]
+
+
+def test_invalid_eviction(tmp_path):
+    with pytest.raises(ValueError):
+        Spool(tmp_path / "spool.db", eviction="drop-random")
+
+
+def test_drop_oldest(config, tmp_path):
+    spool = Spool(tmp_path / "spool.db", max_messages=3)
+    assert all(spool.put(f"t/{i}", "x") for i in range(5))
+    assert spool.count == 3 and spool.evicted == 2
+    assert _topics(spool) == ["t/2", "t/3", "t/4"]
+
+
+def test_drop_new(config, tmp_path):
+    spool = Spool(tmp_path / "spool.db", max_messages=3, eviction="drop-new")
+    assert [spool.put(f"t/{i}", "x") for i in range(5)] == [True] * 3 + [False] * 2
+    assert _topics(spool) == ["t/0", "t/1", "t/2"]
+
+
+def test_survives_reopen(config, tmp_path):
+    spool = Spool(tmp_path / "spool.db")
+    spool.put("t/0", b"\x00\x01", qos=1, retain=True)
+    spool.db.close()
+    spool = Spool(tmp_path / "spool.db")
+    assert spool.count == 1
+    assert spool.db.execute("SELECT payload, qos, retain FROM messages").fetchone() == (
+        b"\x00\x01", 1, 1
+    )
+
+
+def test_drain_in_order(config, tmp_path):
+    published = []
+
+    class Client(FakeClient):
+        def publish(self, topic, payload=None, qos=0, retain=False):
+            published.append(topic)
+            return super().publish(topic, payload, qos, retain)
+
+    spool = Spool(tmp_path / "spool.db", batch_size=4)
+    for i in range(10):
+        spool.put(f"t/{i}", "x")
+    spool.drain(Client())
+    assert published == [f"t/{i}" for i in range(10)]
+    assert spool.count == 0 and _topics(spool) == []
+
+
+def test_drain_keeps_unacknowledged(config, tmp_path):
+    class Client(FakeClient):
+        # acknowledges only every second message
+        def publish(self, topic, payload=None, qos=0, retain=False):
+            on_publish, self.on_publish = self.on_publish, None
+            info = super().publish(topic, payload, qos, retain)
+            self.on_publish = on_publish
+            if info.mid % 2:
+                on_publish(self, None, info.mid)
+            return info
+
+    spool = Spool(tmp_path / "spool.db", batch_size=4, ack_timeout=0.1)
+    for i in range(6):
+        spool.put(f"t/{i}", "x")
+    spool.drain(Client())
+    # the first batch was incomplete: stop, keep the rest
+    assert _topics(spool) == ["t/1", "t/3", "t/4", "t/5"]
+    assert spool.count == 4
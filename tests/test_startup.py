@@ -0,0 +1,42 @@
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from srebot.bench import STARTUP_FORBIDDEN, _importtime
+
+ROOT = Path(__file__).parent.parent
+# the config is passed as obj, the default /etc/sre/sre.conf is not touched
+SRE = (
+    "import sys; sys.argv[:] = {args!r}; from srebot import cli; "
+    "from srebot.config import Config; cli(obj=Config({config_file!r}))"
+)
+
+
+@pytest.fixture
+def sre(config, monkeypatch):
+    monkeypatch.setenv("PYTHONPATH", str(ROOT))
+    (Path(config.config["bots-paths"][0]) / "bot1.py").write_text("def run(client):\n    pass\n")
+    return lambda *args: SRE.format(args=["sre"] + list(args), config_file=str(config.config_file))
+
+
+def _forbidden(modules):
+    return sorted(
+        x for x in modules if x.split(".")[0] in STARTUP_FORBIDDEN or x in STARTUP_FORBIDDEN
+    )
+
+
+@pytest.mark.parametrize("args", [["--help"], ["list"]])
+def test_no_heavy_imports(sre, args):
+    modules = _importtime(sre(*args))
+    assert "srebot" in modules
+    assert _forbidden(modules) == []
+
+
+def test_list(sre):
+    proc = subprocess.run(
+        [sys.executable, "-c", sre("list")],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert proc.returncode == 0
+    assert "bot1.py" in proc.stdout
@@ -0,0 +1,68 @@
+from pathlib import Path
+import pytest
+from srebot.bench import FakeBroker, FakeClient
+from srebot.dispatcher import get_dispatcher
+from srebot.mqtt_tools import _get_subscriptions, on_connect, on_message
+from srebot.tools import get_module
+
+
+@pytest.fixture
+def make_bot(config, tmp_path):
+    def make_bot(source, name="bot"):
+        script = tmp_path / "bots" / f"{name}.py"
+        script.write_text(source)
+        return get_module(script)
+    return make_bot
+
+
+def test_no_subscriptions_without_declaration(make_bot):
+    bot = make_bot("def on_message(client, msg, payload=None):\n    pass\n")
+    assert _get_subscriptions(bot) == []
+
+
+def test_no_subscriptions_without_handlers(make_bot):
+    assert _get_subscriptions(make_bot("SUBSCRIPTIONS = ['a/#']\n")) == []
+
+
+def test_declared_subscriptions(make_bot):
+    bot = make_bot(
+        "SUBSCRIPTIONS = ['a/#', ('b/+', 1)]\n"
+        "def on_message(client, msg, payload=None):\n    pass\n"
+    )
+    assert sorted(_get_subscriptions(bot)) == [("a/#", 0), ("b/+", 1)]
+
+
+OVERLAPPING_BOT = """
+from srebot import on
+SUBSCRIPTIONS = ["x/#"]
+HANDLED = []
+
+def on_message(client, msg, payload=None):
+    HANDLED.append(("on_message", msg.topic))
+
+@on("x/1", qos=1)
+def one(client, msg, payload=None):
+    HANDLED.append(("one", msg.topic))
+"""
+
+
+def test_overlapping_filters_are_subscribed_once(make_bot):
+    assert _get_subscriptions(make_bot(OVERLAPPING_BOT)) == [("x/#", 1)]
+
+
+def test_overlapping_filters_handle_each_message_once(config, make_bot):
+    bot = make_bot(OVERLAPPING_BOT)
+    config.bot = Path(bot.__file__)
+    try:
+        broker = FakeBroker()
+        client = FakeClient(broker)
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.connect()
+        FakeClient(broker).publish("x/1", "1")
+        FakeClient(broker).publish("x/2", "2")
+        for q in get_dispatcher().queues:
+            q.join()
+    finally:
+        config.bot = False
+    assert sorted(bot.HANDLED) == [("on_message", "x/1"), ("on_message", "x/2"), ("one", "x/1")]
@@ -0,0 +1,57 @@
+import paho.mqtt.client as mqtt
+from srebot.mqtt_tools import TopicTrie, _covers, _reduce_subscriptions
+
+FILTERS = [
+    "#", "+", "a", "a/#", "a/+", "a/b", "a/b/c", "a/+/c", "+/b/#", "+/+", "a/b/#",
+    "$SYS/#", "$SYS/+", "+/+/+", "a//c", "/#", "/+",
+]
+TOPICS = ["a", "a/b", "a/b/c", "a/x/c", "b/b/d", "a//c", "/a", "$SYS/x", "$SYS", "x"]
+
+
+def test_topic_trie_matches_like_paho():
+    trie = TopicTrie((x, x) for x in FILTERS)
+    for topic in TOPICS:
+        expected = [x for x in FILTERS if mqtt.topic_matches_sub(x, topic)]
+        assert sorted(trie.match(topic)) == sorted(expected), topic
+
+
+def test_topic_trie_dollar_topics_skip_leading_wildcards():
+    trie = TopicTrie([("#", 1), ("+/x", 2), ("$SYS/#", 3)])
+    assert trie.match("$SYS/x") == [3]
+
+
+def test_topic_trie_deduplicates_values():
+    trie = TopicTrie([("a/#", "bot"), ("a/+", "bot"), ("a/b", "other")])
+    assert sorted(trie.match("a/b")) == ["bot", "other"]
+
+
+def test_topic_trie_strips_shared_subscription():
+    trie = TopicTrie([("$share/group/a/+", "bot")])
+    assert trie.match("a/b") == ["bot"]
+    assert trie.match("$share/group/a/b") == []
+
+
+def test_covers_is_sound():
+    topics = TOPICS + ["x/1", "x", "x/1/2", "$SYS/a/b", "a/b/c/d"]
+    for a in FILTERS:
+        for b in FILTERS:
+            if _covers(a, b):
+                for topic in topics:
+                    if mqtt.topic_matches_sub(b, topic):
+                        assert mqtt.topic_matches_sub(a, topic), (a, b, topic)
+
+
+def test_covers():
+    assert _covers("x/#", "x/1")
+    assert _covers("x/#", "x")
+    assert _covers("x/+", "x/1")
+    assert _covers("#", "+/b/#")
+    assert not _covers("x/1", "x/#")
+    assert not _covers("x/+", "x/#")
+    assert not _covers("#", "$SYS/x")
+    assert not _covers("+/x", "$SYS/x")
+
+
+def test_reduce_subscriptions_keeps_highest_qos():
+    reduced = _reduce_subscriptions([("x/1", 2), ("x/#", 0), ("y/+", 1), ("y/a", 0), ("x/#", 1)])
+    assert sorted(reduced) == [("x/#", 2), ("y/+", 1)]
@@ -0,0 +1,60 @@
+import pytest
+from srebot.bench import FakeBroker, FakeClient, SHARED_BOT
+from srebot.dispatcher import get_dispatcher
+from srebot.mqtt_tools import on_connect, on_message, _get_subscriptions
+from srebot.tools import get_module
+
+
+@pytest.fixture
+def bot(config, tmp_path):
+    script = tmp_path / "bots" / "shared_bot.py"
+    script.write_text(SHARED_BOT)
+    config.bot = script
+    yield script
+    config.bot = False
+
+
+def _start_instances(broker, count):
+    clients = []
+    for _ in range(count):
+        client = FakeClient(broker)
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.connect()
+        clients.append(client)
+    return clients
+
+
+def test_subscriptions_are_shared(bot):
+    assert _get_subscriptions(get_module(bot)) == [("$share/bench/shared/#", 0)]
+
+
+def test_each_message_handled_once(bot):
+    broker = FakeBroker()
+    clients = _start_instances(broker, 3)
+    publisher = FakeClient(broker)
+    for i in range(300):
+        publisher.publish(f"shared/{i}", str(i))
+    for q in get_dispatcher().queues:
+        q.join()
+
+    handled = get_module(bot).HANDLED
+    topics = [topic for _, topic in handled]
+    assert sorted(topics) == sorted(f"shared/{i}" for i in range(300))
+    per_instance = [sum(1 for x, _ in handled if x == id(client)) for client in clients]
+    assert all(per_instance), per_instance
+
+
+def test_without_group_every_instance_handles_all(config, tmp_path):
+    script = tmp_path / "bots" / "plain_bot.py"
+    script.write_text(SHARED_BOT.replace('WORKER_GROUP = "bench"', ""))
+    config.bot = script
+    try:
+        broker = FakeBroker()
+        _start_instances(broker, 3)
+        FakeClient(broker).publish("shared/1", "1")
+        for q in get_dispatcher().queues:
+            q.join()
+        assert len(get_module(script).HANDLED) == 3
+    finally:
+        config.bot = False